@@ -0,0 +1,71 @@
+"""Time the flattened forest against scikit-learn on the listings of a city.
+
+Run from the repository root:
+
+    python benchmarks/bench_forest.py montreal --rows 10000 --single 500
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "streamlit"))
+
+import artifacts as artifacts  # noqa: E402
+import batch as batch  # noqa: E402
+import features as features  # noqa: E402
+import ingest as ingest  # noqa: E402
+
+
+def latencies(predict, X: np.ndarray) -> np.ndarray:
+    """Seconds taken to predict every row of `X` on its own."""
+    timings = np.empty(X.shape[0])
+    for i in range(X.shape[0]):
+        start = time.perf_counter()
+        predict(X[i : i + 1])
+        timings[i] = time.perf_counter() - start
+
+    return timings
+
+
+def throughput(predict, X: np.ndarray) -> float:
+    start = time.perf_counter()
+    predict(X)
+    return X.shape[0] / (time.perf_counter() - start)
+
+
+def run(city: str, rows: int, single: int):
+    model = artifacts.load_model(city)
+    spec = artifacts.load_schema(city)
+
+    listings = batch.read_listings(
+        os.path.join(ingest.DATA_DIR, ingest.city_file(city))
+    )
+    X = features.encode_listings(listings.head(rows), spec)
+
+    # Their agreement is checked by tests/test_forest.py
+    engines = {"sklearn": model["model"].predict, "flat": model["forest"].predict}
+
+    print(f"{city}: {X.shape[0]} rows")
+    print(f"{'engine':<10}{'p50 ms':>10}{'p99 ms':>10}{'rows/s':>12}")
+    for name, predict in engines.items():
+        timings = latencies(predict, X[:single]) * 1000
+        print(
+            f"{name:<10}{np.percentile(timings, 50):>10.3f}"
+            f"{np.percentile(timings, 99):>10.3f}{throughput(predict, X):>12,.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("city", help="City whose model and listings are used")
+    parser.add_argument("--rows", type=int, default=10000, help="Batch size")
+    parser.add_argument(
+        "--single", type=int, default=500, help="Rows timed one at a time"
+    )
+    args = parser.parse_args()
+
+    run(args.city, args.rows, args.single)
@@ -0,0 +1,204 @@
+"""Time the hot paths of the app on synthetic listings at several scales.
+
+Listings and a model are generated once per scale under `--workdir`, then
+every stage is timed cold, with the in-memory caches cleared, and run again
+under tracemalloc for its peak memory. Results are printed and appended as
+one JSON line per run to `--output`, to track regressions over time:
+
+    python benchmarks/bench_pipeline.py --rows 1000 10000 100000
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "streamlit"))
+
+import batch as batch  # noqa: E402
+import cache as cache  # noqa: E402
+import comparables as comparables  # noqa: E402
+import ingest as ingest  # noqa: E402
+import model as model  # noqa: E402
+import plots as plots  # noqa: E402
+import preprocess as preprocess  # noqa: E402
+import schema as schema  # noqa: E402
+import stats as stats  # noqa: E402
+import synthetic as synthetic  # noqa: E402
+
+CITY = "Munich"
+
+# Listing submitted to the feature assembly and prediction stages
+LISTING = {
+    "room_type": "Entire home/apt",
+    "neighbourhood_cleansed": "Neighbourhood 3",
+    "bathrooms_text": "1 bath",
+    "host_response_time": "within an hour",
+    "accommodates": 4,
+    "bedrooms": 2,
+    "beds": 2,
+    "bathrooms": 1,
+    "minimum_nights": 2,
+    "maximum_nights": 365,
+    "availability_365": 120,
+    "instant_bookable": True,
+    "amenities": ["Wifi", "Kitchen", "Heating", "Washer"],
+    "host_verifications": ["email", "phone"],
+}
+
+
+def measure(func, repeat: int = 1, memory: bool = True) -> dict:
+    """Seconds per call of `func`, and the peak MB traced over one more call.
+
+    Memory allocated outside of Python and NumPy, by Arrow for instance, is
+    not traced.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    result = {"seconds": (time.perf_counter() - start) / repeat, "calls": repeat}
+
+    if memory:
+        tracemalloc.start()
+        func()
+        result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+    return result
+
+
+def cold(func):
+    """`func` run with every in-memory cache cleared first."""
+
+    def run():
+        for entries in cache.CACHES.values():
+            entries.clear()
+        return func()
+
+    return run
+
+
+def run_stages(memory: bool = True) -> dict:
+    """Time every stage on the data and model of the working directory."""
+    file = ingest.city_file(CITY)
+    source = os.path.join(ingest.DATA_DIR, file)
+
+    raw = schema.read_listings(source)
+    ingest.build(file)
+    dataset = ingest.load_dataset(file)
+    city_stats = stats.compute(dataset)
+    rf, spec = model.load_model(CITY)
+    row = spec.encode_attributes(LISTING)
+    scored = batch.read_listings(source).head(10_000)
+
+    stages = {
+        "read_csv": lambda: schema.read_listings(source),
+        "preprocess": lambda: preprocess.preprocess(raw.copy()),
+        "ingest_build": lambda: ingest.build(file),
+        "load_dataset": cold(lambda: ingest.load_dataset(file)),
+        "stats": cold(lambda: stats.compute(dataset)),
+        "price_distribution": cold(lambda: plots.price_distribution(city_stats, CITY)),
+        "price_by_neighbourhood": cold(
+            lambda: plots.price_by_neighbourhood(city_stats, CITY)
+        ),
+        "price_by_room_type": cold(lambda: plots.price_by_room_type(city_stats, CITY)),
+        "price_by_amenities": cold(lambda: plots.price_by_amenities(city_stats, CITY)),
+        "visualize_on_map": cold(lambda: plots.visualize_on_map(dataset)),
+        "comparables_index": lambda: comparables.build_index(dataset),
+        "load_model": cold(lambda: model.load_model(CITY)),
+        "encode_listing": (lambda: spec.encode_attributes(LISTING), 1000),
+        "predict": (cold(lambda: model.predict(rf, row, CITY)), 100),
+        "predict_cached": (lambda: model.predict(rf, row, CITY), 1000),
+        "what_if": (cold(lambda: model.what_if(rf, spec, row, CITY)), 10),
+        "predict_batch_10k": lambda: batch.predict_batch(rf, spec, scored),
+    }
+
+    results = {}
+    for name, stage in stages.items():
+        func, repeat = stage if isinstance(stage, tuple) else (stage, 1)
+        results[name] = measure(func, repeat, memory)
+
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(scales: list, workdir: str, memory: bool = True) -> dict:
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scales": {},
+    }
+
+    cwd = os.getcwd()
+    for rows in scales:
+        root = os.path.abspath(os.path.join(workdir, str(rows)))
+        if not os.path.exists(os.path.join(root, ingest.DATA_DIR)):
+            synthetic.generate(root, rows, CITY.lower())
+
+        # Data, cache and model paths are relative to the repository root
+        os.chdir(root)
+        try:
+            report["scales"][rows] = run_stages(memory)
+        finally:
+            os.chdir(cwd)
+
+        print(f"\n{rows:,} listings")
+        print(f"{'stage':<24}{'ms':>12}{'peak MB':>10}")
+        for name, result in report["scales"][rows].items():
+            print(
+                f"{name:<24}{result['seconds'] * 1e3:>12.3f}"
+                f"{result.get('peak_mb', float('nan')):>10.1f}"
+            )
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rows",
+        nargs="+",
+        type=int,
+        default=[1_000, 10_000],
+        help="Numbers of listings to benchmark, e.g. 1000 10000 100000 1000000",
+    )
+    parser.add_argument(
+        "--workdir",
+        default=os.path.join("benchmarks", "work"),
+        help="Where the synthetic data of each scale is generated and kept",
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join("benchmarks", "work", "results.jsonl"),
+        help="JSON lines file the results of the run are appended to, kept out "
+        "of version control under benchmarks/work by default",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="Skip the peak memory runs"
+    )
+    args = parser.parse_args()
+
+    report = run(args.rows, args.workdir, not args.no_memory)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "a") as f:
+        f.write(json.dumps(report) + "\n")
@@ -0,0 +1,256 @@
+"""Generate synthetic Inside Airbnb listings and a small model trained on them.
+
+Writes `data/{city}.csv` and the model artifacts of the city under `out`, laid
+out as the repository root, so the app and the benchmarks can run from there:
+
+    python benchmarks/synthetic.py /tmp/airbnb-10k --rows 10000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MinMaxScaler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "streamlit"))
+
+import artifacts as artifacts  # noqa: E402
+import ingest as ingest  # noqa: E402
+import schema as schema  # noqa: E402
+import train as train  # noqa: E402
+
+SEED = 6954
+
+# Common amenities first, then a long tail each offered by few listings
+AMENITIES = [
+    "Wifi",
+    "Kitchen",
+    "Smoke alarm",
+    "Essentials",
+    "Hair dryer",
+    "Heating",
+    "Hot water",
+    "Dishes and silverware",
+    "Hangers",
+    "Iron",
+    "Coffee maker",
+    "Bed linens",
+    "Refrigerator",
+    "Microwave",
+    "Carbon monoxide alarm",
+    "Cooking basics",
+    "Air conditioning",
+    "Shampoo",
+    "Dedicated workspace",
+    "Oven",
+    "Stove",
+    "Washer",
+    "Dryer",
+    "Free parking on premises",
+    "TV",
+    "Lock on bedroom door",
+    "Fire extinguisher",
+    "First aid kit",
+    "Self check-in",
+    "Long term stays allowed",
+] + [f"Amenity {i}" for i in range(300)]
+
+ROOM_TYPES = ["Entire home/apt", "Private room", "Shared room", "Hotel room"]
+
+BATHROOMS = ["1 bath", "1.5 baths", "2 baths", "1 shared bath", "1 private bath"]
+
+VERIFICATIONS = ["['email', 'phone']", "['email', 'phone', 'work_email']", "['phone']"]
+
+RESPONSE_TIMES = [
+    "within an hour",
+    "within a few hours",
+    "within a day",
+    "a few days or more",
+]
+
+# Distinct amenities lists drawn, listings share them beyond that
+NUM_AMENITY_LISTS = 10_000
+
+# Rows the synthetic model is trained on at most, and its number of trees
+MODEL_ROWS = 5_000
+MODEL_TREES = 20
+
+
+def flags(rng, n: int, p: float = 0.5) -> np.ndarray:
+    return np.where(rng.random(n) < p, "t", "f")
+
+
+def percents(rng, n: int, low: int, missing: float) -> pd.Series:
+    values = pd.Series(rng.integers(low, 101, n)).astype(str) + "%"
+    return values.where(rng.random(n) >= missing)
+
+
+def generate_listings(
+    rows: int,
+    seed: int = SEED,
+    latitude: float = 48.14,
+    longitude: float = 11.58,
+    neighbourhoods: int = 25,
+) -> pd.DataFrame:
+    """Raw listings with the columns and formats of an Inside Airbnb dump.
+
+    Only the columns of `schema.LISTING_DTYPES` are generated. Prices grow
+    with the size, room type and amenities of a listing, so models fitted on
+    them have something to learn.
+    """
+    rng = np.random.default_rng(seed)
+
+    weights = np.r_[np.full(30, 12.0), np.ones(len(AMENITIES) - 30)]
+    amenity_lists = [
+        rng.choice(
+            len(AMENITIES),
+            rng.integers(3, 45),
+            replace=False,
+            p=weights / weights.sum(),
+        )
+        for _ in range(min(rows, NUM_AMENITY_LISTS))
+    ]
+    lists = rng.integers(0, len(amenity_lists), rows)
+    amenities = np.array(
+        [json.dumps([AMENITIES[i] for i in chosen]) for chosen in amenity_lists],
+        dtype=object,
+    )[lists]
+    num_amenities = np.array([len(chosen) for chosen in amenity_lists])[lists]
+
+    room_type = rng.choice(len(ROOM_TYPES), rows, p=[0.6, 0.3, 0.05, 0.05])
+    accommodates = rng.integers(1, 9, rows)
+    neighbourhood = rng.integers(0, neighbourhoods, rows)
+    centers = rng.normal(0, 0.04, (neighbourhoods, 2))
+
+    price = np.exp(
+        3.8
+        + 0.15 * accommodates
+        - 0.4 * (room_type > 0)
+        + 0.01 * num_amenities
+        + 0.1 * centers[neighbourhood, 0] / 0.04
+        + rng.normal(0, 0.35, rows)
+    )
+
+    ids = np.arange(rows) + 10_000_000
+    bedrooms = np.ceil(accommodates / 2) + rng.integers(-1, 2, rows).clip(0)
+
+    return pd.DataFrame(
+        {
+            "id": ids,
+            "listing_url": [f"https://www.airbnb.com/rooms/{i}" for i in ids],
+            "name": [f"Synthetic listing {i}" for i in ids],
+            "picture_url": "https://a0.muscache.com/pictures/synthetic.jpg",
+            "host_since": pd.Timestamp("2012-01-01")
+            + pd.to_timedelta(rng.integers(0, 4000, rows), unit="D"),
+            "host_response_time": pd.Series(
+                np.array(RESPONSE_TIMES, dtype=object)[rng.integers(0, 4, rows)]
+            ).where(rng.random(rows) >= 0.15),
+            "host_response_rate": percents(rng, rows, 40, 0.15),
+            "host_acceptance_rate": percents(rng, rows, 20, 0.1),
+            "host_is_superhost": flags(rng, rows, 0.25),
+            "host_listings_count": rng.geometric(0.4, rows),
+            "host_verifications": rng.choice(VERIFICATIONS, rows),
+            "host_has_profile_pic": flags(rng, rows, 0.97),
+            "host_identity_verified": flags(rng, rows, 0.85),
+            "neighbourhood_cleansed": [f"Neighbourhood {i}" for i in neighbourhood],
+            "latitude": latitude
+            + centers[neighbourhood, 0]
+            + rng.normal(0, 0.01, rows),
+            "longitude": longitude
+            + centers[neighbourhood, 1]
+            + rng.normal(0, 0.015, rows),
+            "room_type": np.array(ROOM_TYPES)[room_type],
+            "accommodates": accommodates,
+            "bathrooms_text": pd.Series(rng.choice(BATHROOMS, rows)).where(
+                rng.random(rows) >= 0.01
+            ),
+            "bedrooms": pd.Series(bedrooms).where(rng.random(rows) >= 0.1),
+            "beds": bedrooms + rng.integers(0, 2, rows),
+            "amenities": amenities,
+            "price": [f"${p:,.2f}" for p in price],
+            "minimum_nights": rng.choice([1, 2, 3, 5, 7, 30, 90, 400], rows),
+            "maximum_nights": rng.choice([30, 365, 1125], rows),
+            "has_availability": flags(rng, rows, 0.95),
+            "availability_365": rng.integers(0, 366, rows),
+            "review_scores_rating": rng.uniform(3, 5, rows).round(2),
+            "instant_bookable": flags(rng, rows, 0.3),
+        },
+        columns=list(schema.LISTING_DTYPES),
+    )
+
+
+def make_model(city: str, trees: int = MODEL_TREES, rows: int = MODEL_ROWS):
+    """Train a small random forest on the listings of `city` and save it.
+
+    The artifacts are written as `train` writes them, from a sample of at
+    most `rows` listings and without feature selection.
+    """
+    data, amenities = ingest.load_city(ingest.city_file(city))
+    data = data.sample(min(rows, data.shape[0]), random_state=SEED)
+    X, y = train.design_matrix(data, amenities.top(20))
+
+    pipeline = Pipeline(
+        [
+            ("scaler", MinMaxScaler()),
+            (
+                "model",
+                RandomForestRegressor(
+                    n_estimators=trees, min_samples_split=30, random_state=SEED
+                ),
+            ),
+        ]
+    )
+    pipeline.fit(X.to_numpy(np.float32), y.to_numpy())
+
+    split = {"feature_names": X.columns.tolist(), "features_to_drop": [], "seconds": {}}
+    result = {
+        "model": pipeline,
+        "scores": (0.0, 0.0),
+        "params": {"model__n_estimators": trees},
+        "compute": 0.0,
+        "seconds": 0.0,
+    }
+    train.save(city, split, {"random_forest": result})
+
+
+def generate(out: str, rows: int, city: str = "munich", trees: int = MODEL_TREES):
+    """Write `rows` synthetic listings of `city` and their model under `out`."""
+    os.makedirs(os.path.join(out, ingest.DATA_DIR), exist_ok=True)
+    os.makedirs(os.path.join(out, artifacts.MODELS_DIR), exist_ok=True)
+
+    start = time.perf_counter()
+    generate_listings(rows).to_csv(
+        os.path.join(out, ingest.DATA_DIR, f"{city}.csv"), index=False
+    )
+    print(f"Generated {rows} listings in {time.perf_counter() - start:.2f}s.")
+
+    # The cache and artifact paths are relative to the repository root
+    cwd = os.getcwd()
+    os.chdir(out)
+    try:
+        start = time.perf_counter()
+        make_model(city, trees)
+        print(f"Trained the {city} model in {time.perf_counter() - start:.2f}s.")
+    finally:
+        os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out", help="Directory to write the data and models to")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument(
+        "--city",
+        default="munich",
+        help="City the listings are named after (default: munich)",
+    )
+    parser.add_argument("--trees", type=int, default=MODEL_TREES)
+    args = parser.parse_args()
+
+    generate(args.out, args.rows, args.city, args.trees)
@@ -1,19 +1,19 @@
 import os
-import streamlit as st
 import pandas as pd
-import preprocess as preprocess
+import streamlit as st
+import comparables as comparables
+import ingest as ingest
 import plots as plots
 import model as model
+import stats as stats
+import tracing as tracing
+import warmup as warmup
 
 # Set the page title and icon
 st.set_page_config(page_title="Airbnb EDA", page_icon=":house:", layout="wide")
 
-
-@st.cache_data(persist=True)
-def load_data(city):
-    data = pd.read_csv(f"./data/{city}")
-    data = preprocess.preprocess(data)
-    return data
+# Time the traced stages of this rerun
+rerun = tracing.start_rerun()
 
 
 # Get filename of cities in data folder
@@ -21,6 +21,9 @@ cities = sorted(os.listdir("./data"))
 city_names = [city.split(".")[0].capitalize() for city in cities]
 cities = dict(zip(city_names, cities))
 
+# Build the models, data and figures of every city off the request path
+warmup.start(cities)
+
 # Create a selectbox to choose a city
 with st.sidebar:
     st.title("Navigation")
@@ -31,23 +34,33 @@ with st.sidebar:
     """
     )
     st.header("Select a city")
-    city = st.selectbox("Cities", cities, index=2, help="Select a city to view data")
+    city = st.selectbox(
+        "Cities",
+        cities,
+        index=2,
+        format_func=lambda name: f"{warmup.badge(name)} {name}",
+        help="Select a city to view data. 🟢 cities are ready to view instantly.",
+    )
+    show_performance = st.checkbox(
+        "Show performance",
+        help="Time of every stage of the page, and whether it came from the cache.",
+    )
 
 if city:
     # Set the title
     st.title(f"Airbnb Analysis: {city.capitalize()}")
     with st.container():
         city_name, file = city, cities[city]
+        warmup.wait(city_name)
 
-        rf, features_to_drop = model.load_model(city_name)
+        dataset = ingest.load_dataset(file)
 
-        data = load_data(file)
-        print(
-            f"Data loaded for {city_name}. {data.shape[0]} rows and {data.shape[1]} columns."  # noqa: E501
-        )
+        city_stats = stats.compute(dataset)
 
-        # Tabs to select different plots
-        tab_1, tab_2, tab_3, tab_4, tab_5, tab_6 = st.tabs(
+        # Views to select different plots. Unlike `st.tabs`, only the selected
+        # view is built and sent to the browser on each rerun
+        view = st.radio(
+            "View",
             [
                 "📊 Price Distribution",
                 "📌 Map of Listings",
@@ -55,24 +68,28 @@ if city:
                 "🏡 Price by Room Type",
                 "📶 Price by Amenities",
                 "🤑 Predict price",
-            ]
+            ],
+            horizontal=True,
+            label_visibility="collapsed",
+            key="view",
         )
 
-        with tab_1:
+        if view == "📊 Price Distribution":
             st.markdown("## Price Distribution Overview")
             st.markdown(
                 "This tab shows the overall distribution of listing prices within the selected city."  # noqa: E501
             )
             st.plotly_chart(
-                plots.price_distribution(data, city_name), use_container_width=True
+                plots.price_distribution(city_stats, city_name),
+                use_container_width=True,
             )
 
-        with tab_2:
-            map = plots.visualize_on_map(data)
+        elif view == "📌 Map of Listings":
+            map = plots.visualize_on_map(dataset)
 
             st.components.v1.html(map, height=500)
 
-        with tab_3:
+        elif view == "🍁 Price by Neighbourhood":
             st.markdown("## Neighborhood Analysis")
             st.markdown(
                 """
@@ -84,7 +101,7 @@ if city:
             # Organizing content in columns
             col1, col2 = st.columns(2)
 
-            price_by_neighbourhood = plots.price_by_neighbourhood(data, city_name)
+            price_by_neighbourhood = plots.price_by_neighbourhood(city_stats, city_name)
             with col1:
                 st.plotly_chart(price_by_neighbourhood[0], use_container_width=True)
 
@@ -93,7 +110,7 @@ if city:
 
             st.plotly_chart(price_by_neighbourhood[2], use_container_width=True)
 
-        with tab_4:
+        elif view == "🏡 Price by Room Type":
             st.markdown("## Room Type Analysis")
             st.markdown(
                 """
@@ -102,7 +119,7 @@ if city:
                 """  # noqa: E501
             )
 
-            price_by_room_type = plots.price_by_room_type(data, city_name)
+            price_by_room_type = plots.price_by_room_type(city_stats, city_name)
 
             col1, col2 = st.columns(2)
 
@@ -112,7 +129,7 @@ if city:
             with col2:
                 st.plotly_chart(price_by_room_type[1], use_container_width=True)
 
-        with tab_5:
+        elif view == "📶 Price by Amenities":
             st.markdown("## Amenities Analysis")
             st.markdown(
                 """
@@ -121,13 +138,13 @@ if city:
                 """  # noqa: E501
             )
 
-            price_by_amenities = plots.price_by_amenities(data, city_name)
+            price_by_amenities = plots.price_by_amenities(city_stats, city_name)
 
             st.plotly_chart(price_by_amenities[0], use_container_width=True)
 
             st.plotly_chart(price_by_amenities[1], use_container_width=True)
 
-        with tab_6:
+        elif view == "🤑 Predict price":
             st.markdown("## Predict the price of a listing")
             st.markdown(
                 """
@@ -136,7 +153,8 @@ if city:
                 """  # noqa: E501
             )
 
-            submitted, user_input = model.get_user_input(data, features_to_drop)
+            rf, spec = model.load_model(city_name)
+            submitted, user_input = model.get_user_input(spec)
 
             if submitted:
                 # st.dataframe(user_input.T, use_container_width=True)
@@ -147,3 +165,45 @@ if city:
                     #### Predicted Price: {currency_prefix}{prediction:.2f} / night
                     """
                 )
+
+                st.markdown("#### Comparable listings")
+                listing = comparables.listing_from_features(spec, user_input, dataset)
+                st.dataframe(
+                    comparables.comparables(dataset, listing),
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        "listing_url": st.column_config.LinkColumn("Listing")
+                    },
+                )
+
+                st.markdown("#### What if...")
+                what_if = model.what_if(rf, spec, user_input, city_name)
+                st.plotly_chart(
+                    plots.what_if(what_if, city_name), use_container_width=True
+                )
+                st.dataframe(what_if, use_container_width=True, hide_index=True)
+
+    # Reruns are summarized per view, to tell which one makes the page slow
+    rerun = tracing.end_rerun(rerun, f"view {view}", city=city_name)
+
+    if show_performance:
+        with st.sidebar:
+            st.header("Performance")
+            st.markdown(f"Page built in **{rerun.ms:.0f} ms**.")
+            st.dataframe(
+                tracing.rerun_table(rerun),
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "ms": st.column_config.NumberColumn(format="%.1f"),
+                    "p95_ms": st.column_config.NumberColumn(
+                        "p95 ms", help="Over the latest calls", format="%.1f"
+                    ),
+                },
+            )
+            with st.expander("All stages"):
+                st.dataframe(
+                    pd.DataFrame.from_dict(tracing.summary(), orient="index"),
+                    use_container_width=True,
+                )
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+import joblib
+from sklearn.tree._tree import NODE_DTYPE
+
+import features as features
+import forest as forest
+import ingest as ingest
+import tracing as tracing
+
+MODELS_DIR = "./streamlit/models"
+
+# Flat forests kept per city, the current one and the latest it replaced,
+# which readers may still be about to map
+FORESTS_KEPT = 2
+
+
+def model_path(city: str) -> str:
+    return os.path.join(MODELS_DIR, f"{city.lower()}_random_forest.gzip")
+
+
+def uncompressed_model_path(city: str) -> str:
+    return os.path.join(MODELS_DIR, f"{city.lower()}_random_forest.joblib")
+
+
+def forests_dir(city: str) -> str:
+    return os.path.join(MODELS_DIR, f"{city.lower()}_flat_forest")
+
+
+def forest_path(city: str, version: int) -> str:
+    """Flat forest of the model version `version` of `city`, in its format."""
+    return os.path.join(forests_dir(city), f"{version}.v{forest.FORMAT_VERSION}")
+
+
+@contextmanager
+def replace_file(path: str):
+    """Path of a temporary file moved to `path` once the block succeeds.
+
+    Readers see either the old file or the complete new one. The name is
+    unique, so concurrent writers of the same file do not clobber each other.
+    """
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", delete=False
+    ) as f:
+        temporary = f.name
+    # Temporary files are private, the artifact keeps the usual permissions
+    os.chmod(temporary, os.stat(path).st_mode if os.path.exists(path) else 0o644)
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def model_version(city: str) -> int:
+    """Changes whenever the model of `city` is trained or refreshed again."""
+    return os.stat(model_path(city)).st_mtime_ns
+
+
+def model_nbytes(model) -> int:
+    """Bytes held by the node and value arrays of the trees of a city model."""
+    forest = model["model"].named_steps["model"]
+    return sum(
+        tree.tree_.node_count * NODE_DTYPE.itemsize + tree.tree_.value.nbytes
+        for tree in forest.estimators_
+    )
+
+
+def model_info_path(city: str) -> str:
+    return os.path.join(MODELS_DIR, f"{city.lower()}_model_info.json")
+
+
+def load_estimator(city: str) -> dict:
+    """Load the scikit-learn artifact of `city`, preferring its uncompressed one.
+
+    Uncompressed artifacts skip the gzip decompression that dominates loading
+    the compressed ones. Only scoring files, refreshing the model and deriving
+    a schema need the estimator, the app and the service predict with the
+    flat forest.
+    """
+    if os.path.exists(uncompressed_model_path(city)):
+        return joblib.load(uncompressed_model_path(city), mmap_mode="r")
+
+    return joblib.load(model_path(city))
+
+
+class Model(dict):
+    """Served model of a city: its flat forest and what is known of its training.
+
+    Holds `"forest"`, memory-mapped and shared by every process on the host,
+    and the `"features"`, `"n_features"` and `"scores"` of the model. The
+    scikit-learn pipeline under `"model"` is loaded on first access only.
+    """
+
+    def __init__(self, city: str, **items):
+        super().__init__(**items)
+        self.city = city
+
+    def __missing__(self, key):
+        if key != "model":
+            raise KeyError(key)
+
+        self["model"] = load_estimator(self.city)["model"]
+        return self["model"]
+
+
+@tracing.traced
+def load_model(city: str) -> Model:
+    """Load the model of `city` to predict with.
+
+    The flat forest and the model info are converted again first when they
+    are missing, of an older format or older than the model.
+    """
+    try:
+        with open(model_info_path(city), "r") as f:
+            info = json.load(f)
+    except FileNotFoundError:
+        info = {}
+
+    if info.get("version") != model_version(city) or (
+        forest.FlatForest.saved_version(forest_path(city, info["version"]))
+        != forest.FORMAT_VERSION
+    ):
+        convert_model(city)
+        with open(model_info_path(city), "r") as f:
+            info = json.load(f)
+
+    model = Model(
+        city,
+        forest=forest.FlatForest.load(forest_path(city, info["version"])),
+        features=info["features"],
+        n_features=info["n_features"],
+        scores=info["scores"],
+    )
+
+    tracing.annotate(forest_mb=model["forest"].nbytes / 1e6)
+
+    return model
+
+
+def convert_model(city: str) -> dict:
+    """Write the uncompressed, flattened and info artifacts of the model of `city`.
+
+    Returns the scikit-learn artifact.
+    """
+    start = time.perf_counter()
+    version = model_version(city)
+    model = joblib.load(model_path(city))
+    # Written aside and moved in place, as the app may have the old one mapped
+    with replace_file(uncompressed_model_path(city)) as path:
+        joblib.dump(model, path, compress=0)
+    forest.FlatForest.from_model(model).save(forest_path(city, version))
+
+    try:
+        feature_names = features.model_feature_names(model)
+    except AttributeError:
+        feature_names = None
+
+    info = {
+        "version": version,
+        "features": feature_names,
+        "n_features": int(model["model"][-1].n_features_in_),
+        "scores": [float(score) for score in model.get("scores", ())],
+    }
+    with replace_file(model_info_path(city)) as path:
+        with open(path, "w") as f:
+            json.dump(info, f, indent=2)
+
+    prune_forests(city, version)
+
+    print(
+        f"Model for {city} converted in {time.perf_counter() - start:.2f}s "
+        f"({os.path.getsize(model_path(city)) / 1e6:.1f} MB -> "
+        f"{os.path.getsize(uncompressed_model_path(city)) / 1e6:.1f} MB)."
+    )
+
+    return model
+
+
+def prune_forests(city: str, version: int):
+    """Remove the flat forests of `city` other than that of the model `version`
+    and the `FORESTS_KEPT - 1` latest others.
+
+    Arrays of flat forests saved before they were versioned are removed too.
+    """
+    current = os.path.basename(forest_path(city, version))
+    entries = os.listdir(forests_dir(city))
+    forests = sorted(
+        (
+            entry
+            for entry in entries
+            if entry.split(".")[0].isdigit() and entry != current
+        ),
+        key=lambda entry: (int(entry.split(".")[0]), entry),
+    )
+    stale = forests[: max(len(forests) - FORESTS_KEPT + 1, 0)] + [
+        entry for entry in entries if entry.endswith(".npy")
+    ]
+    for entry in stale:
+        path = os.path.join(forests_dir(city), entry)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def schema_path(city: str) -> str:
+    return os.path.join(MODELS_DIR, f"{city.lower()}_feature_schema.json")
+
+
+def features_to_drop_path(city: str) -> str:
+    return os.path.join(MODELS_DIR, f"{city.lower()}_features_to_drop.txt")
+
+
+def save_schema(city: str, spec: features.FeatureSpec):
+    with open(schema_path(city), "w") as f:
+        json.dump(spec.to_dict(), f, indent=2)
+
+
+def load_schema(city: str) -> features.FeatureSpec:
+    with open(schema_path(city), "r") as f:
+        return features.FeatureSpec.from_dict(json.load(f))
+
+
+def export_schema(city: str, model) -> features.FeatureSpec:
+    """Write the feature schema of a city model saved without one.
+
+    The schema is derived from the model, its `*_features_to_drop.txt` and the
+    cached listings of the city, which supply the top 20 amenities.
+    """
+    with open(features_to_drop_path(city), "r") as f:
+        features_to_drop = f.read().splitlines()
+
+    data, amenities = ingest.load_city(ingest.city_file(city))
+    spec = features.FeatureSpec.from_model(
+        model, features_to_drop, data, amenities.top(20)
+    )
+    spec.validate(model)
+    save_schema(city, spec)
+
+    print(f"Feature schema {spec.hash[:12]} written for {city}.")
+
+    return spec
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write the uncompressed artifact and the feature schema of every city model."  # noqa: E501
+    )
+    parser.add_argument(
+        "cities", nargs="*", help="Cities to export (default: all of them)"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Overwrite existing artifacts"
+    )
+    args = parser.parse_args()
+
+    cities = args.cities or sorted(
+        file.split(".")[0] for file in os.listdir(ingest.DATA_DIR)
+    )
+    for city in cities:
+        if args.force or not os.path.exists(uncompressed_model_path(city)):
+            convert_model(city)
+        else:
+            print(f"Uncompressed model for {city} already exists.")
+
+        if args.force or not os.path.exists(schema_path(city)):
+            export_schema(city, load_model(city))
+        else:
+            print(f"Feature schema for {city} already exists.")
@@ -0,0 +1,83 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import features as features
+import model as model
+import schema as schema
+
+# Raw columns read from the listings to score
+SCORING_COLUMNS = ["id"] + features.FEATURE_COLUMNS
+
+
+def read_listings(path: str) -> pd.DataFrame:
+    """Read the listings to score from an Inside Airbnb CSV or Parquet file."""
+    if path.endswith(".parquet"):
+        return schema.parse_listings(
+            pd.read_parquet(path, columns=SCORING_COLUMNS), SCORING_COLUMNS
+        )
+
+    return schema.read_listings(path, columns=SCORING_COLUMNS)
+
+
+def write_predictions(predictions: pd.DataFrame, path: str):
+    if path.endswith(".parquet"):
+        predictions.to_parquet(path, index=False)
+    else:
+        predictions.to_csv(path, index=False)
+
+
+def predict_batch(
+    rf, spec: features.FeatureSpec, data: pd.DataFrame, chunk_size: int = 10000
+) -> np.ndarray:
+    """Predict the nightly price of every listing in `data`.
+
+    Listings are encoded and scored `chunk_size` rows at a time, so memory
+    stays bounded for arbitrarily large files. They go through the whole
+    pipeline, scaler included.
+    """
+    pipeline = rf["model"]
+
+    predictions = np.empty(data.shape[0])
+    for start in range(0, data.shape[0], chunk_size):
+        chunk = data.iloc[start : start + chunk_size]
+        encoded = features.encode_listings(chunk, spec)
+        if hasattr(pipeline, "feature_names_in_"):
+            encoded = pd.DataFrame(encoded, columns=spec.feature_names)
+        predictions[start : start + chunk_size] = pipeline.predict(encoded)
+
+    return np.exp(predictions)
+
+
+def score_file(city: str, source: str, target: str, chunk_size: int = 10000) -> dict:
+    """Score the listings in `source` with the model of `city` into `target`."""
+    rf, spec = model.load_model(city)
+
+    start = time.perf_counter()
+    data = read_listings(source)
+    prices = predict_batch(rf, spec, data, chunk_size)
+    elapsed = time.perf_counter() - start
+
+    write_predictions(pd.DataFrame({"id": data["id"], "price": prices}), target)
+
+    print(
+        f"Scored {data.shape[0]} listings for {city} in {elapsed:.2f}s "
+        f"({data.shape[0] / elapsed:,.0f} rows/s)."
+    )
+
+    return {"rows": data.shape[0], "seconds": elapsed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Predict nightly prices for a file of Inside Airbnb listings."
+    )
+    parser.add_argument("city", help="City whose model scores the listings")
+    parser.add_argument("source", help="Listings to score (.csv or .parquet)")
+    parser.add_argument("target", help="Where to write the predictions")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    score_file(args.city, args.source, args.target, args.chunk_size)
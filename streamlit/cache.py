@@ -0,0 +1,185 @@
+import dataclasses
+import functools
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import tracing as tracing
+
+# Default size limit of each cache class in MB, overridden by the
+# `CACHE_{NAME}_MB` environment variables (e.g. CACHE_MODELS_MB=512)
+LIMITS_MB = {
+    "models": 1024,
+    "datasets": 1024,
+    "figures": 256,
+    "maps": 256,
+    "predictions": 16,
+}
+
+# Caches of many small entries, whose evictions are logged at DEBUG only
+QUIET = {"predictions"}
+
+
+def sizeof(value) -> int:
+    """Approximate bytes held in memory by `value`.
+
+    Memory-mapped arrays count as empty, their pages belong to the page cache.
+    """
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if sparse.issparse(value):
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if hasattr(value, "to_plotly_json"):
+        return sizeof(value.to_plotly_json())
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(sizeof(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(sizeof(v) for v in value)
+    if dataclasses.is_dataclass(value):
+        return sum(sizeof(getattr(value, f.name)) for f in dataclasses.fields(value))
+
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Thread-safe cache evicting the least recently used entries by size.
+
+    Entries are evicted until the cache holds at most `max_bytes`. Values
+    larger than the whole cache are returned but not stored.
+    """
+
+    def __init__(self, name: str, max_bytes: int, verbose: bool = True):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key) -> tuple:
+        """`(True, value)` for a cached key, `(False, None)` otherwise."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key][0]
+
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, nbytes: int):
+        stored, evicted = nbytes <= self.max_bytes, []
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+
+            if stored:
+                self.entries[key] = (value, nbytes)
+                self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                entry, (_, size) = self.entries.popitem(last=False)
+                self.nbytes -= size
+                self.evictions += 1
+                evicted.append((entry, size))
+
+        # Logged once the lock is released
+        if not stored:
+            tracing.event(
+                "cache.skip", logging.WARNING, cache=self.name, key=key, bytes=nbytes
+            )
+
+        for entry, size in evicted:
+            tracing.event(
+                "cache.evict",
+                logging.INFO if self.verbose else logging.DEBUG,
+                cache=self.name,
+                key=entry,
+                bytes=size,
+            )
+
+    def discard(self, match):
+        """Remove the entries whose key `match(key)` is true for."""
+        with self.lock:
+            for key in [key for key in self.entries if match(key)]:
+                self.nbytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "mb": self.nbytes / 1e6,
+            "limit_mb": self.max_bytes / 1e6,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+CACHES = {
+    name: LRUCache(
+        name,
+        int(float(os.getenv(f"CACHE_{name.upper()}_MB", mb)) * 1e6),
+        verbose=name not in QUIET,
+    )
+    for name, mb in LIMITS_MB.items()
+}
+
+
+def key(*args, **kwargs) -> tuple:
+    # Datasets and the stats derived from them are keyed on their fingerprint
+    return tuple(getattr(arg, "fingerprint", arg) for arg in args) + tuple(
+        sorted((name, getattr(arg, "fingerprint", arg)) for name, arg in kwargs.items())
+    )
+
+
+def cached(name: str, size=sizeof):
+    """Memoize a function in the cache class `name`.
+
+    Arguments with a `fingerprint` are keyed on it, others must be hashable.
+    `size` estimates the bytes of a result. Concurrent misses on the same key
+    may compute it more than once, the last result is kept. Every call is
+    traced as a span, with whether it hit the cache.
+    """
+    cache = CACHES[name]
+
+    def decorator(func):
+        stage = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            entry = (func.__qualname__,) + key(*args, **kwargs)
+            with tracing.span(stage, cache=name) as span:
+                hit, value = cache.get(entry)
+                span.set(hit=hit)
+                if not hit:
+                    value = func(*args, **kwargs)
+                    cache.put(entry, value, size(value))
+
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def stats() -> dict:
+    """Counters of every cache class."""
+    return {name: cache.stats() for name, cache in CACHES.items()}
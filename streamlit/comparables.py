@@ -0,0 +1,182 @@
+import os
+from dataclasses import dataclass
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+import cache as cache
+import features as features
+import ingest as ingest
+import spatial as spatial
+import tracing as tracing
+
+# Listing features compared besides the location, with their weight against
+# one kilometre once scaled to unit variance
+FEATURE_WEIGHTS = {"accommodates": 1.0, "bedrooms": 1.0, "bathrooms": 0.5}
+
+# Weight of a different room type and of each top amenity offered by only one
+# of two listings, against one kilometre
+ROOM_TYPE_WEIGHT = 3.0
+AMENITY_WEIGHT = 0.25
+
+# Columns of the comparables shown next to a prediction
+COMPARABLE_COLUMNS = [
+    "name",
+    "neighbourhood_cleansed",
+    "room_type",
+    "accommodates",
+    "bedrooms",
+    "bathrooms",
+    "price",
+    "distance_km",
+    "listing_url",
+]
+
+
+@dataclass(eq=False)
+class ComparablesIndex:
+    """Ball tree over the listings of a city, for similar listing lookups.
+
+    Listings are points of their planar location in kilometres and of their
+    scaled, weighted features, so the Euclidean distance between two points
+    trades kilometres against differences in size, room type and amenities.
+    `fingerprint` is the one of the dataset the index was built from.
+    """
+
+    fingerprint: str
+    tree: BallTree
+    origin_latitude: float
+    room_types: list
+    amenities: list
+    mean: np.ndarray
+    scale: np.ndarray
+
+    def points(self, data: pd.DataFrame) -> np.ndarray:
+        """Points of preprocessed listings, or of listings alike."""
+        numeric = data[list(FEATURE_WEIGHTS)].to_numpy(dtype=float)
+        numeric = np.nan_to_num((numeric - self.mean) / self.scale)
+
+        room_types = (
+            data["room_type"].to_numpy()[:, None] == np.array(self.room_types)
+        ) * (ROOM_TYPE_WEIGHT / np.sqrt(2))
+
+        return np.column_stack(
+            [
+                spatial.project_km(
+                    data["latitude"], data["longitude"], self.origin_latitude
+                ),
+                numeric * np.array(list(FEATURE_WEIGHTS.values())),
+                room_types,
+                data[self.amenities].to_numpy(dtype=float) * AMENITY_WEIGHT,
+            ]
+        )
+
+    def query(self, data: pd.DataFrame, k: int = 20) -> tuple:
+        """Positions of the `k` listings closest to each listing of `data`.
+
+        Returns the positions in the indexed dataset and their distances
+        on the ground, in kilometres. Cities with fewer than `k` listings
+        return all of them.
+        """
+        points = self.points(data)
+        _, positions = self.tree.query(points, k=min(k, self.tree.data.shape[0]))
+
+        indexed = np.asarray(self.tree.data)[positions]
+        km = np.linalg.norm(indexed[..., :2] - points[:, None, :2], axis=-1)
+
+        return positions, km
+
+
+def index_path(file: str) -> str:
+    return os.path.join(ingest.CACHE_DIR, f"{file.split('.')[0]}.comparables.joblib")
+
+
+@tracing.traced
+def build_index(dataset: ingest.Dataset) -> ComparablesIndex:
+    data = dataset.data
+    numeric = data[list(FEATURE_WEIGHTS)].to_numpy(dtype=float)
+
+    index = ComparablesIndex(
+        dataset.fingerprint,
+        None,
+        float(data["latitude"].mean()),
+        data["room_type"].dropna().unique().tolist(),
+        dataset.amenities.top(20),
+        np.nanmean(numeric, axis=0),
+        np.nanstd(numeric, axis=0) + 1e-9,
+    )
+    index.tree = BallTree(index.points(data))
+    tracing.annotate(listings=data.shape[0])
+
+    return index
+
+
+def index_nbytes(index: ComparablesIndex) -> int:
+    return sum(array.nbytes for array in index.tree.get_arrays())
+
+
+@cache.cached("datasets", size=index_nbytes)
+def load_index(dataset: ingest.Dataset) -> ComparablesIndex:
+    """Comparables index of a dataset, persisted with the city cache.
+
+    The index is rebuilt when the one on disk comes from other listings.
+    """
+    path = index_path(dataset.file)
+    if os.path.exists(path):
+        index = joblib.load(path)
+        if index.fingerprint == dataset.fingerprint:
+            return index
+
+    index = build_index(dataset)
+
+    os.makedirs(ingest.CACHE_DIR, exist_ok=True)
+    joblib.dump(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+    return index
+
+
+def listing_from_features(
+    spec: features.FeatureSpec, row: np.ndarray, dataset: ingest.Dataset
+) -> pd.DataFrame:
+    """Preprocessed listing alike to the encoded listing `row`.
+
+    Its location is the median one of the listings of its neighbourhood, or
+    of the city when the neighbourhood is unknown.
+    """
+    data = dataset.data
+    values = {name: row[0, i] for name, i in spec.index.items()}
+
+    def category(col):
+        chosen = [name for name in spec.options[col] if values.get(name) == 1]
+        return chosen[0][len(col) + 1 :] if chosen else None
+
+    neighbourhood = category("neighbourhood_cleansed")
+    located = data[data["neighbourhood_cleansed"] == neighbourhood]
+    if located.empty:
+        located = data
+
+    listing = {
+        "latitude": located["latitude"].median(),
+        "longitude": located["longitude"].median(),
+        "room_type": category("room_type"),
+    }
+    for name in list(FEATURE_WEIGHTS) + dataset.amenities.top(20):
+        listing[name] = values.get(name, 0)
+
+    return pd.DataFrame([listing])
+
+
+@tracing.traced
+def comparables(
+    dataset: ingest.Dataset, listing: pd.DataFrame, k: int = 20
+) -> pd.DataFrame:
+    """The `k` listings of a city most similar to `listing`, most similar first."""
+    index = load_index(dataset)
+    positions, km = index.query(listing, k)
+
+    found = dataset.data.iloc[positions[0]].assign(distance_km=km[0])
+
+    return found[[col for col in COMPARABLE_COLUMNS if col in found.columns]]
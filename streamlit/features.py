@@ -0,0 +1,365 @@
+import hashlib
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+import preprocess as preprocess
+import tracing as tracing
+
+SCHEMA_VERSION = 1
+
+# Raw listing columns used as model features as they are
+NUMERIC_COLUMNS = [
+    "host_acceptance_rate",
+    "host_is_superhost",
+    "host_listings_count",
+    "accommodates",
+    "bedrooms",
+    "beds",
+    "minimum_nights",
+    "maximum_nights",
+    "has_availability",
+    "availability_365",
+    "instant_bookable",
+]
+
+# Features derived from the raw columns by `preprocess`
+DERIVED_DTYPES = {
+    "bathrooms": "float64",
+    "bathrooms_is_shared": "bool",
+    "num_amenities": "int64",
+}
+
+# Columns one-hot encoded as `{column}_{value}` by the training notebook
+CATEGORICAL_COLUMNS = [
+    "host_response_time",
+    "neighbourhood_cleansed",
+    "room_type",
+    "bathrooms_text",
+]
+
+# Raw listing columns needed to encode the features of a city model
+FEATURE_COLUMNS = (
+    NUMERIC_COLUMNS + CATEGORICAL_COLUMNS + ["amenities", "host_verifications"]
+)
+
+
+def model_feature_names(model) -> list:
+    """Columns the city model was trained on, in training order."""
+    # Models fitted on arrays carry the names of their columns alongside
+    if "features" in model:
+        if model["features"] is None:
+            raise AttributeError("The model was fitted without feature names.")
+        return list(model["features"])
+
+    return model["model"].feature_names_in_.tolist()
+
+
+def parse_verifications(verifications: pd.Series) -> pd.DataFrame:
+    """Dummies of the host verification lists ("['email', 'phone']")."""
+    return (
+        verifications.astype(str)
+        .str.replace(r"\[|\]|\'", "", regex=True)
+        .str.get_dummies(sep=", ")
+        .rename(lambda x: "host_verification_" + x, axis=1)
+        .astype("uint8")
+    )
+
+
+def schema_hash(features: list, dtypes: dict, vocabularies: dict) -> str:
+    payload = json.dumps(
+        {"features": features, "dtypes": dtypes, "vocabularies": vocabularies},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@dataclass
+class FeatureSpec:
+    """Feature schema of a city model, persisted next to the model artifact.
+
+    Holds the exact training feature order, the dtype of each feature and the
+    category vocabularies seen in training. `index` maps every feature name to
+    its position, so inputs are encoded straight into NumPy rows in training
+    order, and the form offers exactly the trained categories.
+    """
+
+    feature_names: list
+    dtypes: dict
+    vocabularies: dict
+    hash: str = None
+    index: dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        expected = schema_hash(self.feature_names, self.dtypes, self.vocabularies)
+        if self.hash is None:
+            self.hash = expected
+        elif self.hash != expected:
+            raise ValueError("Feature schema does not match its hash.")
+
+        self.index = {name: i for i, name in enumerate(self.feature_names)}
+
+    @property
+    def top_amenities(self) -> list:
+        return self.vocabularies["amenities"]
+
+    @property
+    def options(self) -> dict:
+        """Dummy feature names offered by the form for each categorical input."""
+        options = {
+            col: [f"{col}_{value}" for value in self.vocabularies[col]]
+            for col in CATEGORICAL_COLUMNS
+        }
+        options["host_verifications"] = [
+            f"host_verification_{value}"
+            for value in self.vocabularies["host_verifications"]
+        ]
+        return options
+
+    def positions(self, names) -> np.ndarray:
+        """Feature positions of `names`, -1 for features the model lacks."""
+        return np.array([self.index.get(name, -1) for name in names], dtype=int)
+
+    def validate(self, model):
+        """Raise if `model` was not trained on the features of this schema."""
+        try:
+            trained_on = model_feature_names(model)
+        except AttributeError:
+            trained_on = None
+
+        if "n_features" in model:
+            n_features = model["n_features"]
+        else:
+            n_features = model["model"].named_steps["model"].n_features_in_
+        if len(self.feature_names) != n_features or trained_on not in (
+            None,
+            self.feature_names,
+        ):
+            raise ValueError(
+                f"Feature schema {self.hash[:12]} does not match the model features."
+            )
+
+    def to_dict(self) -> dict:
+        return {
+            "version": SCHEMA_VERSION,
+            "hash": self.hash,
+            "features": self.feature_names,
+            "dtypes": self.dtypes,
+            "vocabularies": self.vocabularies,
+        }
+
+    @classmethod
+    def from_dict(cls, schema: dict) -> "FeatureSpec":
+        if schema.get("version") != SCHEMA_VERSION:
+            raise ValueError(
+                f"Unsupported feature schema version: {schema.get('version')}"
+            )
+
+        return cls(
+            schema["features"], schema["dtypes"], schema["vocabularies"], schema["hash"]
+        )
+
+    @classmethod
+    def from_model(
+        cls, model, features_to_drop: list, data: pd.DataFrame, top_amenities: list
+    ) -> "FeatureSpec":
+        """Derive the schema of a model saved without one.
+
+        Vocabularies come from the dummy columns the model was trained on. Models
+        fitted without column names fall back to the categories in `data` and to
+        the column layout of the form, minus `features_to_drop`.
+        """
+        try:
+            feature_names = model_feature_names(model)
+        except AttributeError:
+            verifications = parse_verifications(
+                pd.Series(data["host_verifications"].dropna().unique())
+            )
+            feature_names = [
+                name
+                for name in NUMERIC_COLUMNS[:4]
+                + ["bathrooms"]
+                + NUMERIC_COLUMNS[4:]
+                + ["bathrooms_is_shared", "num_amenities"]
+                + sorted(top_amenities)
+                + verifications.columns.tolist()
+                + [
+                    f"{col}_{value}"
+                    for col in CATEGORICAL_COLUMNS
+                    for value in data[col].dropna().unique()
+                ]
+                if name not in features_to_drop
+            ]
+
+        def vocabulary(prefix):
+            return [
+                name[len(prefix) :] for name in feature_names if name.startswith(prefix)
+            ]
+
+        vocabularies = {col: vocabulary(f"{col}_") for col in CATEGORICAL_COLUMNS}
+        vocabularies["host_verifications"] = vocabulary("host_verification_")
+        vocabularies["amenities"] = list(top_amenities)
+
+        dtypes = {}
+        for name in feature_names:
+            if name in NUMERIC_COLUMNS:
+                dtypes[name] = str(data[name].dtype)
+            else:
+                dtypes[name] = DERIVED_DTYPES.get(name, "uint8")
+
+        return cls(feature_names, dtypes, vocabularies)
+
+    @tracing.traced
+    def encode(self, values: dict) -> np.ndarray:
+        """Feature row of one listing given the values of its named features.
+
+        Features missing from `values` are zero, and names the model was not
+        trained on are ignored.
+        """
+        row = np.zeros((1, len(self.feature_names)), dtype=np.float32)
+        for name, value in values.items():
+            position = self.index.get(name)
+            if position is not None:
+                row[0, position] = value
+
+        return row
+
+    def check_attributes(self, attributes: dict) -> list:
+        """Problems with the attributes of a listing, empty when there are none.
+
+        Attributes must be known, numeric ones finite numbers and categories
+        and host verifications among those seen in training. Amenities are
+        any strings, only the top amenities count.
+        """
+        if not isinstance(attributes, dict):
+            return ["a listing is an object of attributes"]
+
+        problems = []
+        for name, value in attributes.items():
+            if name in CATEGORICAL_COLUMNS:
+                if str(value) not in self.vocabularies[name]:
+                    problems.append(f"{name}: unseen value {value!r}")
+            elif name in ("amenities", "host_verifications"):
+                if not isinstance(value, list) or not all(
+                    isinstance(v, str) for v in value
+                ):
+                    problems.append(f"{name}: not a list of strings")
+                elif name == "host_verifications":
+                    problems.extend(
+                        f"{name}: unseen value {v!r}"
+                        for v in value
+                        if v not in self.vocabularies[name]
+                    )
+            elif name in NUMERIC_COLUMNS or name in DERIVED_DTYPES:
+                if not isinstance(value, (bool, int, float)) or not np.isfinite(value):
+                    problems.append(f"{name}: not a number: {value!r}")
+            else:
+                problems.append(f"unknown attribute {name!r}")
+
+        return problems
+
+    def encode_attributes(self, attributes: dict) -> np.ndarray:
+        """Feature row of one listing given its attributes, as sent as JSON.
+
+        Numeric attributes are named as their features, categorical ones
+        (`room_type`, ...) take one of their values, and `amenities` and
+        `host_verifications` a list of them. `num_amenities` defaults to the
+        number of top amenities listed. Raises a ValueError listing every
+        problem found by `check_attributes`.
+        """
+        problems = self.check_attributes(attributes)
+        if problems:
+            raise ValueError("; ".join(problems))
+
+        values = {}
+        for name, value in attributes.items():
+            if name in CATEGORICAL_COLUMNS:
+                values[f"{name}_{value}"] = 1
+            elif name == "amenities":
+                values.update(dict.fromkeys(value, 1))
+            elif name == "host_verifications":
+                values.update({f"host_verification_{v}": 1 for v in value})
+            else:
+                values[name] = value
+
+        values.setdefault(
+            "num_amenities",
+            len(set(attributes.get("amenities", [])) & set(self.top_amenities)),
+        )
+
+        return self.encode(values)
+
+
+@tracing.traced
+def encode_listings(data: pd.DataFrame, spec: FeatureSpec) -> np.ndarray:
+    """Encode raw listings into the feature matrix of a city model.
+
+    `data` holds the `FEATURE_COLUMNS` of the listings, typed by `schema`. The
+    result has one row per listing and the columns of `spec`, in training order.
+    Categories and amenities unseen in training are dropped, and numeric values
+    still missing are imputed with the median of the batch.
+    """
+    matrix = np.zeros((data.shape[0], len(spec.feature_names)), dtype=np.float32)
+
+    def put(name, values):
+        position = spec.index.get(name)
+        if position is not None:
+            values = pd.Series(values, dtype=float)
+            matrix[:, position] = values.fillna(values.median()).fillna(0)
+
+    def put_categories(prefix, values, codes):
+        # `codes` maps listings to `values`, the distinct values of the column
+        # Columns missing from the whole batch have no values and all codes -1
+        rows = np.flatnonzero(codes >= 0)
+        positions = spec.positions([f"{prefix}_{value}" for value in values])
+        positions = positions[codes[rows]]
+        rows, positions = rows[positions >= 0], positions[positions >= 0]
+        matrix[rows, positions] = 1
+
+    for col in NUMERIC_COLUMNS:
+        if col != "bedrooms":
+            put(col, data[col].to_numpy())
+
+    # Fill NAs for bedrooms with median value of bedrooms by neighbourhood
+    put(
+        "bedrooms",
+        data.groupby("neighbourhood_cleansed")["bedrooms"]
+        .transform(lambda x: x.fillna(x.median()))
+        .to_numpy(),
+    )
+
+    put(
+        "bathrooms",
+        data["bathrooms_text"].str.extract(r"(\d+\.?\d*)", expand=False).to_numpy(),
+    )
+    put(
+        "bathrooms_is_shared",
+        data["bathrooms_text"].str.contains("shared", case=False).fillna(False),
+    )
+
+    for col in CATEGORICAL_COLUMNS:
+        codes, values = pd.factorize(data[col])
+        put_categories(col, values, codes)
+
+    # Verification lists are parsed once per distinct list
+    codes, values = pd.factorize(data["host_verifications"])
+    verifications = parse_verifications(pd.Series(values))
+    positions = spec.positions(verifications.columns)
+    known = positions >= 0
+    dummies = verifications.to_numpy()[:, known]
+    rows = np.flatnonzero(codes >= 0)
+    matrix[np.ix_(rows, positions[known])] = dummies[codes[rows]]
+
+    amenities = preprocess.tokenize_amenities(
+        preprocess.clean_amenities(data["amenities"])
+    )
+    top = np.isin(amenities.vocabulary, spec.top_amenities)
+    put("num_amenities", amenities.matrix[:, top].getnnz(axis=1))
+
+    positions = spec.positions(amenities.vocabulary)
+    known = positions >= 0
+    matrix[:, positions[known]] = amenities.matrix[:, known].toarray()
+
+    return matrix
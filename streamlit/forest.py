@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass, fields
+
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler
+
+# Bump whenever the flattened arrays change meaning, so that flat forests
+# written by an older version are flattened again on the next load.
+FORMAT_VERSION = 2
+
+
+def input_scalers(pipeline) -> list:
+    """`(scale_, min_)` of the scalers applied before the forest, in order.
+
+    Only MinMaxScaler and "passthrough" steps are supported. Their transforms
+    are increasing, so they fold into the split thresholds.
+    """
+    scalers = []
+    for name, step in pipeline.steps[:-1]:
+        if isinstance(step, MinMaxScaler) and not step.clip:
+            scalers.append((step.scale_, step.min_))
+        elif step not in (None, "passthrough"):
+            raise ValueError(f"Cannot flatten a forest after the {name} step.")
+
+    return scalers
+
+
+def fold_thresholds(threshold: np.ndarray, feature: np.ndarray, scalers: list):
+    """Thresholds on the unscaled features with the same splits as `threshold`.
+
+    A float32 value goes left when its scaled value is at most the threshold.
+    The scaled value is computed as MinMaxScaler does, rounded to float32
+    after each operation, so the folded threshold is the largest float32
+    value that still goes left once scaled, and splits match exactly.
+    """
+
+    def scaled(x):
+        for scale, offset in scalers:
+            x = (x * scale[feature]).astype(np.float32)
+            x = (x + offset[feature]).astype(np.float32)
+        return x
+
+    x = threshold
+    for scale, offset in reversed(scalers):
+        x = (x - offset[feature]) / scale[feature]
+    x = x.astype(np.float32)
+
+    # The estimate is off by a few float32 steps at most
+    while np.any(over := scaled(x) > threshold):
+        x = np.where(over, np.nextafter(x, np.float32(-np.inf)), x)
+    while np.any(
+        under := scaled(up := np.nextafter(x, np.float32(np.inf))) <= threshold
+    ):
+        x = np.where(under, up, x)
+
+    return x.astype(np.float64)
+
+
+@dataclass
+class FlatForest:
+    """Random forest regressor flattened into contiguous NumPy arrays.
+
+    The nodes of all trees are concatenated and `roots` holds the first node
+    of every tree. `children` stores the absolute positions of the left and
+    right child of each node side by side, so one step down the trees is a
+    single gather. Leaves point to themselves with an infinite threshold.
+    Thresholds apply to the unscaled features, the scaler of the pipeline is
+    folded into them.
+    """
+
+    feature: np.ndarray
+    threshold: np.ndarray
+    children: np.ndarray
+    value: np.ndarray
+    roots: np.ndarray
+    depth: int
+
+    @classmethod
+    def from_model(cls, model) -> "FlatForest":
+        pipeline = model["model"]
+        scalers = input_scalers(pipeline)
+        trees = [estimator.tree_ for estimator in pipeline[-1].estimators_]
+        roots = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+
+        feature, threshold, children, value = [], [], [], []
+        for root, tree in zip(roots, trees):
+            nodes = np.arange(root, root + tree.node_count)
+            is_leaf = tree.children_left < 0
+
+            split = np.where(is_leaf, 0, tree.feature)
+            feature.append(split)
+            threshold.append(
+                np.where(
+                    is_leaf, np.inf, fold_thresholds(tree.threshold, split, scalers)
+                )
+            )
+            children.append(
+                np.column_stack(
+                    [
+                        np.where(is_leaf, nodes, tree.children_left + root),
+                        np.where(is_leaf, nodes, tree.children_right + root),
+                    ]
+                )
+            )
+            value.append(tree.value[:, 0, 0])
+
+        return cls(
+            np.concatenate(feature).astype(np.int32),
+            np.concatenate(threshold),
+            np.concatenate(children).astype(np.int32).ravel(),
+            np.concatenate(value),
+            roots.astype(np.int32),
+            max(tree.max_depth for tree in trees),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            getattr(self, f.name).nbytes for f in fields(self) if f.name != "depth"
+        )
+
+    def save(self, path: str):
+        """Write the arrays to the new directory `path`, as one .npy file each.
+
+        The forest is written aside and renamed into place whole, so a reader
+        never maps arrays of two different forests. A forest already saved at
+        `path` is kept: save each model version under a path of its own.
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=parent, prefix=".flat_forest.")
+        try:
+            for f in fields(self):
+                np.save(os.path.join(staging, f"{f.name}.npy"), getattr(self, f.name))
+            np.save(os.path.join(staging, "format.npy"), FORMAT_VERSION)
+
+            # Temporary directories are private
+            os.chmod(staging, 0o755)
+            os.rename(staging, path)
+        except OSError:
+            if FlatForest.saved_version(path) != FORMAT_VERSION:
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    @staticmethod
+    def saved_version(path: str) -> int:
+        """Format version of the flat forest saved at `path`, 0 if there is none."""
+        try:
+            return int(np.load(os.path.join(path, "format.npy")))
+        except FileNotFoundError:
+            return 0
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = "r") -> "FlatForest":
+        arrays = {
+            f.name: np.load(os.path.join(path, f"{f.name}.npy"), mmap_mode=mmap_mode)
+            for f in fields(cls)
+        }
+        arrays["depth"] = int(arrays["depth"])
+
+        return cls(**arrays)
+
+    def predict(self, X, chunk_size: int = 16384) -> np.ndarray:
+        """Mean leaf value over all trees for every row of `X`.
+
+        Every (row, tree) pair is pushed down its tree at once. Pairs that
+        reached a leaf are summed and dropped every few steps, so the work
+        follows the depth of the leaves rather than the deepest tree. Rows are
+        compared as float32, as scikit-learn does.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        predictions = np.empty(X.shape[0])
+
+        for start in range(0, X.shape[0], chunk_size):
+            chunk = X[start : start + chunk_size]
+            values = chunk.ravel()
+
+            rows = np.repeat(np.arange(chunk.shape[0], dtype=np.int32), self.roots.size)
+            offsets = rows * np.int32(X.shape[1])
+            nodes = np.tile(self.roots, chunk.shape[0])
+            total = np.zeros(chunk.shape[0])
+
+            step = 0
+            while nodes.size:
+                # NaN goes right, as in scikit-learn
+                go_right = ~(
+                    values[offsets + self.feature[nodes]] <= self.threshold[nodes]
+                )
+                nodes = self.children[2 * nodes + go_right]
+
+                step += 1
+                if step % 4 == 0 or step >= self.depth:
+                    leaf = self.children[2 * nodes] == nodes
+                    total += np.bincount(
+                        rows[leaf], self.value[nodes[leaf]], minlength=chunk.shape[0]
+                    )
+                    nodes, rows, offsets = nodes[~leaf], rows[~leaf], offsets[~leaf]
+
+            predictions[start : start + chunk_size] = total / self.roots.size
+
+        return predictions
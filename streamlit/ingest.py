@@ -0,0 +1,229 @@
+import argparse
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+import cache as cache
+import preprocess as preprocess
+import schema as schema
+import tracing as tracing
+
+DATA_DIR = "./data"
+CACHE_DIR = "./cache"
+
+# Bump whenever `preprocess.preprocess` changes its output, so that cached
+# frames written by an older version are rebuilt on the next load.
+CACHE_VERSION = 3
+
+
+def city_file(city: str) -> str:
+    """Name of the data file of `city` in the data folder."""
+    for file in os.listdir(DATA_DIR):
+        if file.split(".")[0].lower() == city.lower():
+            return file
+
+    raise FileNotFoundError(f"No data file for {city} in {DATA_DIR}")
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def cache_paths(file: str) -> tuple:
+    stem = file.split(".")[0]
+    return (
+        os.path.join(CACHE_DIR, f"{stem}.feather"),
+        os.path.join(CACHE_DIR, f"{stem}.json"),
+        os.path.join(CACHE_DIR, f"{stem}.amenities.npz"),
+    )
+
+
+def snapshot_paths(file: str) -> tuple:
+    """Row hashes and amenity tokens of every listing of the last ingested CSV.
+
+    `refresh` diffs a new scrape against them, so only changed listings are
+    preprocessed again.
+    """
+    stem = file.split(".")[0]
+    return (
+        os.path.join(CACHE_DIR, f"{stem}.rows.npz"),
+        os.path.join(CACHE_DIR, f"{stem}.tokens.npz"),
+    )
+
+
+def row_hashes(data: pd.DataFrame) -> np.ndarray:
+    """Hash of every parsed listing, changing with any of its values."""
+    return pd.util.hash_pandas_object(data, index=False).to_numpy()
+
+
+def read_manifest(file: str) -> dict:
+    _, manifest_path, _ = cache_paths(file)
+    try:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_fresh(file: str, manifest: dict) -> bool:
+    """Check whether the cached frame for `file` matches the source CSV.
+
+    The size and modification time recorded in the manifest are checked first,
+    so an untouched CSV is never re-hashed. The content hash decides only when
+    the file has been touched.
+    """
+    frame_path, _, amenities_path = cache_paths(file)
+    if manifest.get("version") != CACHE_VERSION:
+        return False
+
+    if not (os.path.exists(frame_path) and os.path.exists(amenities_path)):
+        return False
+
+    stat = os.stat(os.path.join(DATA_DIR, file))
+    if (stat.st_size, stat.st_mtime_ns) == (
+        manifest.get("source_size"),
+        manifest.get("source_mtime_ns"),
+    ):
+        return True
+
+    return file_digest(os.path.join(DATA_DIR, file)) == manifest.get("source_sha256")
+
+
+def write_manifest(file: str, manifest: dict):
+    _, manifest_path, _ = cache_paths(file)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+@tracing.traced
+def build(
+    file: str, data: pd.DataFrame = None, tokens: preprocess.Amenities = None
+) -> dict:
+    """Parse and preprocess the raw CSV for `file` and write it to the cache.
+
+    `data` are the listings of the CSV when already parsed, and `tokens`
+    their amenities when already tokenized, as `refresh` does.
+    """
+    source = os.path.join(DATA_DIR, file)
+
+    if data is None:
+        data = schema.read_listings(source)
+    if tokens is None:
+        tokens = preprocess.tokenize_amenities(
+            preprocess.clean_amenities(data["amenities"])
+        )
+
+    ids, hashes = data["id"].to_numpy(), row_hashes(data)
+    data, amenities = preprocess.preprocess(data, tokens)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    frame_path, _, amenities_path = cache_paths(file)
+    rows_path, tokens_path = snapshot_paths(file)
+
+    # Uncompressed Arrow IPC can be memory-mapped on load without decoding.
+    # It is written aside and moved in place, as readers may have it mapped
+    feather.write_feather(
+        data.reset_index(drop=True), frame_path + ".tmp", compression="uncompressed"
+    )
+    os.replace(frame_path + ".tmp", frame_path)
+    amenities.save(amenities_path)
+    np.savez(rows_path, id=ids, hash=hashes)
+    tokens.save(tokens_path)
+
+    stat = os.stat(source)
+    manifest = {
+        "version": CACHE_VERSION,
+        "source": file,
+        "source_sha256": file_digest(source),
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "rows": int(data.shape[0]),
+        "columns": data.columns.tolist(),
+    }
+
+    write_manifest(file, manifest)
+
+    tracing.annotate(file=file, rows=manifest["rows"])
+
+    return manifest
+
+
+def load_city(file: str, columns: list = None) -> tuple:
+    """Load the preprocessed listings and amenities for `file`.
+
+    The cache is rebuilt first if it is stale. Only `columns` are read from the
+    memory-mapped cache file when given.
+    """
+    manifest = read_manifest(file)
+    if not is_fresh(file, manifest):
+        build(file)
+
+    return read_cache(file, columns)
+
+
+def read_cache(file: str, columns: list = None) -> tuple:
+    """Cached listings and amenities of `file`, as they are, stale or not."""
+    frame_path, _, amenities_path = cache_paths(file)
+    table = feather.read_table(frame_path, columns=columns, memory_map=True)
+
+    return table.to_pandas(), preprocess.Amenities.load(amenities_path)
+
+
+@dataclass(eq=False)
+class Dataset:
+    """Preprocessed listings of a city with a fingerprint of their content.
+
+    The fingerprint combines the hash of the source CSV with CACHE_VERSION, so
+    it changes whenever the listings or their preprocessing do. Cached
+    functions taking a Dataset are keyed on it by `cache`, instead of hashing
+    the whole frame on every rerun.
+    """
+
+    file: str
+    fingerprint: str
+    data: pd.DataFrame
+    amenities: preprocess.Amenities
+
+
+def load_dataset(file: str) -> Dataset:
+    """Load the Dataset of `file`, cached until the source file changes."""
+    stat = os.stat(os.path.join(DATA_DIR, file))
+    return _load_dataset(file, stat.st_size, stat.st_mtime_ns)
+
+
+@cache.cached("datasets")
+def _load_dataset(file: str, source_size: int, source_mtime_ns: int) -> Dataset:
+    data, amenities = load_city(file)
+    fingerprint = f"{read_manifest(file)['source_sha256']}-v{CACHE_VERSION}"
+    tracing.annotate(file=file, rows=data.shape[0], columns=data.shape[1])
+
+    return Dataset(file, fingerprint, data, amenities)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the columnar listings cache for every city in the data folder."  # noqa: E501
+    )
+    parser.add_argument(
+        "cities", nargs="*", help="Data files to ingest (default: all of them)"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Rebuild even if the cache is fresh"
+    )
+    args = parser.parse_args()
+
+    for file in args.cities or sorted(os.listdir(DATA_DIR)):
+        if args.force or not is_fresh(file, read_manifest(file)):
+            build(file)
+        else:
+            print(f"Cache for {file} is up to date.")
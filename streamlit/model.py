@@ -1,9 +1,14 @@
 import streamlit as st
 from streamlit_extras.grid import grid
 from streamlit_extras.row import row
-import pandas as pd
+import hashlib
+import threading
 import numpy as np
-import joblib
+import pandas as pd
+import artifacts as artifacts
+import cache as cache
+import features as features
+import tracing as tracing
 
 tickprefixes_city = {
     "Boston": "US$",
@@ -14,19 +19,83 @@ tickprefixes_city = {
 }
 
 
-@st.cache_resource
+# Predictions of feature rows, keyed on the city, the version of its model
+# and a digest of the row
+predictions = cache.CACHES["predictions"]
+
+# Approximate bytes held by one cached prediction and its key
+PREDICTION_NBYTES = 320
+
+# Values tried for the numeric attributes by the what-if sweeps, with the
+# label of the attribute
+WHAT_IF_RANGES = {
+    "accommodates": ("Guests", range(1, 9)),
+    "bedrooms": ("Bedrooms", range(0, 6)),
+    "minimum_nights": ("Minimum nights", [1, 2, 3, 5, 7, 14, 30]),
+}
+
+
+# One lock per city, held while its model is looked up or loaded
+load_locks = {}
+
+
+def loaded_model_nbytes(loaded) -> int:
+    model, _ = loaded
+    # Memory-mapped forests count as empty, the estimator once it was loaded
+    nbytes = cache.sizeof(model["forest"])
+    if "model" in model:
+        nbytes += artifacts.model_nbytes(model)
+    return nbytes
+
+
 def load_model(city):
-    model = joblib.load(f"./streamlit/models/{city.lower()}_random_forest.gzip")
-    with open(f"./streamlit/models/{city.lower()}_features_to_drop.txt", "r") as f:
-        features_to_drop = f.read().splitlines()
+    """Model and feature schema of `city`, reloaded once its artifact changes.
+
+    Loads of the same city are serialized, so a changed artifact is converted
+    once when several threads ask for it.
+    """
+    with load_locks.setdefault(city, threading.Lock()):
+        return _load_model(city, artifacts.model_version(city))
+
+
+def loaded_model(city):
+    """Model and feature schema of `city` if its current version is cached.
+
+    Never loads, so it is cheap enough to call from the serving event loop.
+    """
+    hit, loaded = cache.CACHES["models"].get(
+        ("_load_model", city, artifacts.model_version(city))
+    )
+    return loaded if hit else None
+
+
+# Least recently used models are evicted past the "models" cache limit and
+# mapped again from their flat forests on the next visit
+@cache.cached("models", size=loaded_model_nbytes)
+def _load_model(city, version: int):
+    model = artifacts.load_model(city)
+    model["version"] = version
+
+    # Predictions of the models this one replaces are never looked up again
+    predictions.discard(lambda key: key[0] == city and key[1] != version)
+
+    # Models saved before feature schemas existed get one written on first load
+    try:
+        spec = artifacts.load_schema(city)
+    except FileNotFoundError:
+        spec = artifacts.export_schema(city, model)
 
-    print(f"Model loaded for {city}.")
+    spec.validate(model)
 
-    return model, features_to_drop
+    tracing.annotate(city=city, schema=spec.hash[:12])
 
+    return model, spec
 
-def create_selectbox(row_item: row, data: pd.DataFrame, column: str, label: str = None):
-    options = column + "_" + data[column].dropna().unique()
+
+def create_selectbox(
+    row_item: row, spec: features.FeatureSpec, column: str, label: str = None
+):
+    options = spec.options[column]
 
     if label is None:
         label = column.replace("_", " ").capitalize()
@@ -37,37 +106,19 @@ def create_selectbox(row_item: row, data: pd.DataFrame, column: str, label: str
         format_func=lambda x: x.split("_")[-1],
     )
 
-    return selectbox, options
-
+    return selectbox
 
-def get_user_input(data: pd.DataFrame, features_to_drop: list):
-    list_of_amenities = sorted(
-        (
-            data["amenities"]
-            .str.split(", ")
-            .explode()
-            .value_counts()
-            .to_frame()
-            .reset_index()
-            .head(20)
-        )["index"].tolist()
-    )
 
-    host_verification_options = (
-        data["host_verifications"]
-        .str.replace(r"\[|\]|\'", "", regex=True)
-        .str.get_dummies(sep=", ")
-        .rename(lambda x: "host_verification_" + x, axis=1)
-        .astype("uint8")
-    ).columns.tolist()
+def get_user_input(spec: features.FeatureSpec):
+    list_of_amenities = sorted(spec.top_amenities)
 
     with st.form("input_form"):
         with st.expander("**Listing information**", expanded=True):
             room_details = grid(
                 1, [1, 1, 1], [1, 1, 1], 1, [1, 1], vertical_align="center"
             )
-            room_type, room_type_options = create_selectbox(
-                room_details, data, "room_type", label="Room Type"
+            room_type = create_selectbox(
+                room_details, spec, "room_type", label="Room Type"
             )
 
             accommodates = room_details.number_input("Number of Guests", value=1)
@@ -75,13 +126,13 @@ def get_user_input(data: pd.DataFrame, features_to_drop: list):
             beds = room_details.number_input("Number of Beds", value=1)
 
             bathrooms = room_details.number_input("Number of Bathrooms", value=1)
-            bathrooms_text, bathrooms_text_options = create_selectbox(
-                room_details, data, "bathrooms_text", label="Bathrooms Type"
+            bathrooms_text = create_selectbox(
+                room_details, spec, "bathrooms_text", label="Bathrooms Type"
             )
             bathrooms_is_shared = room_details.checkbox("Bathrooms is Shared?")
 
-            neighbourhood, neighbourhood_options = create_selectbox(
-                room_details, data, "neighbourhood_cleansed", label="Neighbourhood"
+            neighbourhood = create_selectbox(
+                room_details, spec, "neighbourhood_cleansed", label="Neighbourhood"
             )
             amenities = room_details.multiselect(
                 "Amenities", options=list_of_amenities, default=[]
@@ -111,13 +162,13 @@ def get_user_input(data: pd.DataFrame, features_to_drop: list):
 
         with st.expander("**Host information**"):
             host_detail = grid([1, 1, 1, 1], 1, vertical_align="center")
-            host_response_time, host_response_time_options = create_selectbox(
-                host_detail, data, "host_response_time", label="Host Response Time"
+            host_response_time = create_selectbox(
+                host_detail, spec, "host_response_time", label="Host Response Time"
             )
 
             host_verification = host_detail.multiselect(
                 "Host Verification",
-                options=host_verification_options,
+                options=spec.options["host_verifications"],
                 format_func=lambda x: x.split("_", maxsplit=2)[-1].capitalize(),
             )
 
@@ -140,69 +191,134 @@ def get_user_input(data: pd.DataFrame, features_to_drop: list):
         submitted = st.form_submit_button("Submit", type="primary")
 
     if submitted:
-        columns = [
-            "host_acceptance_rate",
-            "host_is_superhost",
-            "host_listings_count",
-            "accommodates",
-            "bathrooms",
-            "bedrooms",
-            "beds",
-            "minimum_nights",
-            "maximum_nights",
-            "has_availability",
-            "availability_365",
-            "instant_bookable",
-            "bathrooms_is_shared",
-            "num_amenities",
-        ]
-
-        columns.extend(list_of_amenities)
-        columns.extend(host_verification_options)
-        columns.extend(host_response_time_options)
-        columns.extend(neighbourhood_options)
-        columns.extend(room_type_options)
-        columns.extend(bathrooms_text_options)
-
-        user_input = pd.DataFrame(
-            np.zeros_like(columns, dtype=int).reshape(1, -1),
-            columns=columns,
-        )
-
-        user_input["host_acceptance_rate"] = host_acceptance_rate
-        user_input["host_is_superhost"] = host_is_superhost
-        user_input["host_listings_count"] = host_listings_count
-        user_input["accommodates"] = accommodates
-        user_input["bathrooms"] = bathrooms
-        user_input["bedrooms"] = bedrooms
-        user_input["beds"] = beds
-        user_input["minimum_nights"] = minimum_nights
-        user_input["maximum_nights"] = maximum_nights
-        user_input["has_availability"] = has_availability
-        user_input["availability_365"] = availability_365
-        user_input["instant_bookable"] = instant_bookable
-        user_input["bathrooms_is_shared"] = bathrooms_is_shared
-        user_input["num_amenities"] = num_amenities
-
-        for amenity in amenities:
-            user_input[amenity] = 1
-
-        for verification in host_verification:
-            user_input[verification] = 1
-
-        user_input[room_type] = 1
-        user_input[neighbourhood] = 1
-        user_input[bathrooms_text] = 1
-        user_input[host_response_time] = 1
-
-        user_input.drop(features_to_drop, axis=1, inplace=True)
-
-        return submitted, user_input
+        values = {
+            "host_acceptance_rate": host_acceptance_rate,
+            "host_is_superhost": host_is_superhost,
+            "host_listings_count": host_listings_count,
+            "accommodates": accommodates,
+            "bathrooms": bathrooms,
+            "bedrooms": bedrooms,
+            "beds": beds,
+            "minimum_nights": minimum_nights,
+            "maximum_nights": maximum_nights,
+            "has_availability": has_availability,
+            "availability_365": availability_365,
+            "instant_bookable": instant_bookable,
+            "bathrooms_is_shared": bathrooms_is_shared,
+            "num_amenities": num_amenities,
+        }
+
+        for flag in amenities + host_verification:
+            values[flag] = 1
+
+        for option in [room_type, neighbourhood, bathrooms_text, host_response_time]:
+            values[option] = 1
+
+        return submitted, spec.encode(values)
     else:
         return submitted, None
 
 
+def prediction_key(city, version: int, row: np.ndarray) -> tuple:
+    return (city, version, hashlib.blake2b(row.tobytes(), digest_size=16).digest())
+
+
+@tracing.traced
+def predict_rows(model, X: np.ndarray, city) -> np.ndarray:
+    """Log prices of the feature rows `X`, cached by feature row.
+
+    Rows predicted before by the same model are looked up, the others are
+    predicted in a single forest call.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    keys = [prediction_key(city, model["version"], row) for row in X]
+
+    results = np.empty(X.shape[0])
+    missing = []
+    for i, key in enumerate(keys):
+        hit, value = predictions.get(key)
+        if hit:
+            results[i] = value
+        else:
+            missing.append(i)
+
+    tracing.annotate(rows=X.shape[0], predicted=len(missing))
+    if missing:
+        results[missing] = model["forest"].predict(X[missing])
+        for i in missing:
+            predictions.put(keys[i], results[i], PREDICTION_NBYTES)
+
+    return results
+
+
 def predict(model, input, city):
-    prediction = model["model"].named_steps["model"].predict(input).item()
+    prediction = predict_rows(model, input, city).item()
 
     return (tickprefixes_city[city], np.exp(prediction))
+
+
+@tracing.traced
+def what_if(model, spec: features.FeatureSpec, row: np.ndarray, city) -> pd.DataFrame:
+    """Price change of a listing under single attribute changes, best first.
+
+    `row` is the encoded listing. Every top amenity the model uses is added
+    or removed, instant booking is flipped and the `WHAT_IF_RANGES`
+    attributes are set to each of their values, one change per variant. All
+    the variants are scored in a single forest call.
+    """
+    labels, attributes, rows, positions, values = [], [], [], [], []
+
+    def vary(label, attribute, changes):
+        # `changes` maps feature names to their value in the variant
+        changes = {
+            spec.index[name]: value
+            for name, value in changes.items()
+            if name in spec.index
+        }
+        if changes and any(row[0, i] != value for i, value in changes.items()):
+            labels.append(label)
+            attributes.append(attribute)
+            rows.extend([len(labels)] * len(changes))
+            positions.extend(changes)
+            values.extend(changes.values())
+
+    # The number of top amenities offered follows the amenity toggled, when
+    # the model has it. Top amenities dropped from the model would only change
+    # that count
+    for amenity in spec.top_amenities:
+        if amenity not in spec.index:
+            continue
+        offered = row[0, spec.index[amenity]] == 1
+        changes = {amenity: 0 if offered else 1}
+        if "num_amenities" in spec.index:
+            num_amenities = row[0, spec.index["num_amenities"]]
+            changes["num_amenities"] = num_amenities + (-1 if offered else 1)
+        vary(f"{'Remove' if offered else 'Add'} {amenity}", "Amenities", changes)
+
+    if "instant_bookable" in spec.index:
+        bookable = row[0, spec.index["instant_bookable"]] == 1
+        vary(
+            f"{'Disable' if bookable else 'Enable'} instant booking",
+            "Instant booking",
+            {"instant_bookable": 0 if bookable else 1},
+        )
+
+    for name, (attribute, options) in WHAT_IF_RANGES.items():
+        for value in options:
+            vary(f"{attribute}: {value}", attribute, {name: value})
+
+    X = np.repeat(row, len(labels) + 1, axis=0)
+    X[rows, positions] = values
+    prices = np.exp(predict_rows(model, X, city))
+
+    table = pd.DataFrame(
+        {
+            "change": labels,
+            "attribute": attributes,
+            "price": prices[1:],
+            "uplift": prices[1:] - prices[0],
+        }
+    )
+    table["uplift_pct"] = 100 * table["uplift"] / prices[0]
+
+    return table.sort_values("uplift", ascending=False, ignore_index=True)
@@ -1,5 +1,5 @@
-import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import plotly.figure_factory as ff
@@ -7,6 +7,13 @@ from plotly.subplots import make_subplots
 import seaborn as sns
 import folium
 from folium import plugins, branca
+from branca.element import MacroElement
+from jinja2 import Template
+import cache as cache
+import ingest as ingest
+import spatial as spatial
+import stats as stats
+import tracing as tracing
 
 sns.set_style("whitegrid")
 sns.set_context("talk")
@@ -20,10 +27,10 @@ tickprefixes_city = {
 }
 
 
-@st.cache_data(persist=True)
-def price_distribution(data: pd.DataFrame, city: str):
+@cache.cached("figures")
+def price_distribution(city_stats: stats.CityStats, city: str):
     fig = ff.create_distplot(
-        [data["price"]],
+        [city_stats.price],
         group_labels=["Price"],
         colors=["red"],
         bin_size=25,
@@ -40,14 +47,10 @@ def price_distribution(data: pd.DataFrame, city: str):
     return fig
 
 
-@st.cache_data(persist=True)
-def price_by_neighbourhood(data: pd.DataFrame, city: str):
+@cache.cached("figures")
+def price_by_neighbourhood(city_stats: stats.CityStats, city: str):
     num_listings_by_neighborhood = (
-        data["neighbourhood_cleansed"]
-        .value_counts()
-        .to_frame()
-        .reset_index()
-        .rename(columns={"index": "neighbourhood", "neighbourhood_cleansed": "count"})
+        city_stats.neighbourhoods["count"].rename_axis("neighbourhood").reset_index()
     )
 
     # -------------------------------------------------------------------------
@@ -78,20 +81,14 @@ def price_by_neighbourhood(data: pd.DataFrame, city: str):
     # -------------------------------------------------------------------------
     # Then, we see the price of listings in the top 10 neighbourhoods
     top_neighborhoods = num_listings_by_neighborhood.iloc[:10]["neighbourhood"].values
-    data_top_neighborhoods = data[
-        data["neighbourhood_cleansed"].isin(top_neighborhoods)
-    ]
 
     # Create a box plot for each of the top 10 neighborhoods
     fig_1 = go.Figure()
 
     for neighborhood in top_neighborhoods:
-        neighborhood_data = data_top_neighborhoods[
-            data_top_neighborhoods["neighbourhood_cleansed"] == neighborhood
-        ]
         fig_1.add_trace(
             go.Box(
-                y=neighborhood_data["price"],
+                y=city_stats.neighbourhood_samples[neighborhood],
                 name=neighborhood,
                 marker=dict(
                     color="rgb(8,81,156)",
@@ -117,16 +114,9 @@ def price_by_neighbourhood(data: pd.DataFrame, city: str):
     # -------------------------------------------------------------------------
     # Calculate the average price for the top 10 neighborhoods
     avg_price_by_neighborhood = (
-        (
-            data[
-                data["neighbourhood_cleansed"].isin(
-                    num_listings_by_neighborhood.iloc[:10]["neighbourhood"].values
-                )
-            ]
-            .groupby("neighbourhood_cleansed")["price"]
-            .agg(["mean", "count"])
-        )
-        .reindex(index=num_listings_by_neighborhood.iloc[:10]["neighbourhood"].values)
+        city_stats.neighbourhoods[["mean", "count"]]
+        .iloc[:10]
+        .rename_axis("neighbourhood_cleansed")
         .reset_index()
     )
 
@@ -165,15 +155,11 @@ def price_by_neighbourhood(data: pd.DataFrame, city: str):
     return fig_0, fig_1, fig_2
 
 
-@st.cache_data(persist=True)
-def price_by_room_type(data: pd.DataFrame, city: str):
+@cache.cached("figures")
+def price_by_room_type(city_stats: stats.CityStats, city: str):
     # First, we check the `room_type` column
     num_listings_by_room_type = (
-        data["room_type"]
-        .value_counts()
-        .to_frame()
-        .reset_index()
-        .rename(columns={"index": "room_type", "room_type": "count"})
+        city_stats.room_types["count"].rename_axis("room_type").reset_index()
     )
 
     # -------------------------------------------------------------------------
@@ -208,7 +194,7 @@ def price_by_room_type(data: pd.DataFrame, city: str):
     for room in num_listings_by_room_type.room_type.values:
         fig_1.add_trace(
             go.Violin(
-                y=data[data["room_type"] == room]["price"],
+                y=city_stats.room_type_samples[room],
                 name=room,
                 box_visible=True,
                 meanline_visible=True,
@@ -232,18 +218,9 @@ def price_by_room_type(data: pd.DataFrame, city: str):
     return fig_0, fig_1
 
 
-@st.cache_data(persist=True)
-def price_by_amenities(data: pd.DataFrame, city: str):
-    list_of_amenities = (
-        data["amenities"]
-        .str.split(", ")
-        .explode()
-        .value_counts()
-        .to_frame()
-        .reset_index()
-    )
-
-    top_20_amenities = list_of_amenities.head(20)
+@cache.cached("figures")
+def price_by_amenities(city_stats: stats.CityStats, city: str):
+    top_20_amenities = city_stats.amenities
 
     # -------------------------------------------------------------------------
     colors = px.colors.qualitative.Set1 * (
@@ -253,9 +230,9 @@ def price_by_amenities(data: pd.DataFrame, city: str):
     fig_0 = go.Figure(
         data=[
             go.Bar(
-                x=top_20_amenities["index"],
-                y=top_20_amenities["amenities"],
-                text=top_20_amenities["amenities"],
+                x=top_20_amenities["amenity"],
+                y=top_20_amenities["count"],
+                text=top_20_amenities["count"],
                 hovertemplate="Number of listings: %{y}<extra></extra>",
                 marker_color=colors,
             )
@@ -278,20 +255,14 @@ def price_by_amenities(data: pd.DataFrame, city: str):
     # -------------------------------------------------------------------------
     # Distribution of price by amenities using violin plot
 
-    def create_violin_for_amenity(data, amenity):
+    def create_violin_for_amenity(amenity):
         fig = go.Figure()
 
-        for present in ["Yes", "No"]:
+        for present, prices in city_stats.amenity_samples[amenity].items():
             fig.add_trace(
                 go.Violin(
-                    x=data["amenity"][
-                        (data["amenity"] == amenity)
-                        & (data["amenity_present"] == present)
-                    ],
-                    y=data["price"][
-                        (data["amenity"] == amenity)
-                        & (data["amenity_present"] == present)
-                    ],
+                    x=np.full(prices.size, amenity),
+                    y=prices,
                     name=present,
                     side="negative" if present == "Yes" else "positive",
                     line_color="green" if present == "Yes" else "red",
@@ -307,32 +278,19 @@ def price_by_amenities(data: pd.DataFrame, city: str):
 
         return fig
 
-    # Prepare data
-    data_1 = (
-        data.loc[:, ["price"] + top_20_amenities["index"].tolist()[:5]]
-        .melt(id_vars="price", var_name="amenity", value_name="amenity_present")
-        .replace({1: "Yes", 0: "No"})
-    )
-
-    data_2 = (
-        data.loc[:, ["price"] + top_20_amenities["index"].tolist()[6:11]]
-        .melt(id_vars="price", var_name="amenity", value_name="amenity_present")
-        .replace({1: "Yes", 0: "No"})
-    )
-
     # Create subplots: 2 rows and 5 columns for 10 amenities
     fig_1 = make_subplots(
-        rows=2, cols=5, subplot_titles=top_20_amenities["index"].tolist()[:10]
+        rows=2, cols=5, subplot_titles=top_20_amenities["amenity"].tolist()[:10]
     )
 
     # Generate plots for each amenity
-    for i, amenity in enumerate(top_20_amenities["index"].tolist()[:5], 1):
-        amenity_fig = create_violin_for_amenity(data_1, amenity)
+    for i, amenity in enumerate(top_20_amenities["amenity"].tolist()[:5], 1):
+        amenity_fig = create_violin_for_amenity(amenity)
         for trace in amenity_fig.data:
             fig_1.add_trace(trace, row=1, col=i)
 
-    for i, amenity in enumerate(top_20_amenities["index"].tolist()[6:11], 1):
-        amenity_fig = create_violin_for_amenity(data_2, amenity)
+    for i, amenity in enumerate(top_20_amenities["amenity"].tolist()[6:11], 1):
+        amenity_fig = create_violin_for_amenity(amenity)
         for trace in amenity_fig.data:
             fig_1.add_trace(trace, row=2, col=i)
 
@@ -351,47 +309,284 @@ def price_by_amenities(data: pd.DataFrame, city: str):
     return fig_0, fig_1
 
 
-@st.cache_resource
-def visualize_on_map(data: pd.DataFrame):
-    map = folium.Map(
-        location=[data["latitude"].mean(), data["longitude"].mean()],
-        zoom_start=12,
-        max_zoom=20,
-        tiles=None,
+@tracing.traced
+def what_if(table: pd.DataFrame, city: str, top: int = 20):
+    """Bar chart of the largest price changes of a what-if sweep."""
+    table = table.reindex(
+        table["uplift"].abs().sort_values(ascending=False).index[:top]
+    ).sort_values("uplift")
+
+    fig = go.Figure(
+        go.Bar(
+            x=table["uplift"],
+            y=table["change"],
+            orientation="h",
+            marker_color=np.where(table["uplift"] >= 0, "green", "red"),
+            customdata=table[["price", "uplift_pct"]],
+            hovertemplate="%{y}<br>Price: %{customdata[0]:.2f}"
+            "<br>Change: %{x:+.2f} (%{customdata[1]:+.1f}%)<extra></extra>",
+        )
     )
 
-    folium.TileLayer("cartodbpositron", opacity=1, control=False).add_to(map)
+    fig.update_layout(
+        title="Price change per night by listing change",
+        xaxis_title="Change in predicted price",
+        xaxis_tickprefix=tickprefixes_city[city],
+        template="plotly_white",
+        height=max(400, 25 * len(table)),
+        margin=dict(l=250),
+    )
 
-    # Create a color scale based on the price of listings in data
-    vmin = data["price"].quantile(0.05)
-    vmax = data["price"].quantile(0.95)
+    return fig
 
-    colors = ["green", "lightgreen", "yellow", "orange", "red"]
-    price_scale = branca.colormap.LinearColormap(
-        colors,
-        vmin=vmin,
-        vmax=vmax,
-        caption="Price",
-        index=[
-            vmin,
-            (vmin + vmax) / 4,
-            (vmin + vmax) / 2,
-            3 * (vmin + vmax) / 4,
-            vmax,
-        ],
-    )
 
-    price_scale = price_scale.to_step(15)
+def price_steps(price, price_scale) -> np.ndarray:
+    """Index of the step of `price_scale` each price falls in."""
+    steps = np.searchsorted(price_scale.index, price, side="right")
+    return np.clip(steps, 1, len(price_scale.index) - 1) - 1
 
-    price_scale.add_to(map)
 
-    listings_group = plugins.MarkerCluster(name="Listings", control=False)
-    map.add_child(listings_group)
+# Functions shared by the listing layers to create a marker for the listing at
+# position `i` of the payload, with a popup rendered when it is opened
+LISTING_MARKER_JS = """
+function escape(value) {
+    return String(value).replace(/[&<>"']/g, function (c) {
+        return "&#" + c.charCodeAt(0) + ";";
+    });
+}
 
-    room_type = {}
-    for r_type in data["room_type"].unique():
-        room_type[r_type] = plugins.FeatureGroupSubGroup(listings_group, name=r_type)
+function popup(i) {
+    var rating = data.rating[i] === null ? "nan" : data.rating[i];
+    return "<div style='font-family: Helvetica, Arial, sans-serif; width: 360px;'>"
+        + "<h4 style='margin-bottom: 10px; color: #333;'>" + escape(data.name[i]) + "</h4>"
+        + "<div style='font-size: 14px; color: #888; margin-bottom: 10px;'>"
+        + "<p style='margin: 2px 0;'><b>Price:</b> $" + data.price[i] + "</p>"
+        + "<p style='margin: 2px 0;'><b>Neighbourhood:</b> " + escape(data.neighbourhoods[data.neighbourhood[i]]) + "</p>"
+        + "<p style='margin: 2px 0;'><b>Room type:</b> " + escape(data.room_types[data.room_type[i]]) + "</p>"
+        + "<p style='margin: 2px 0;'><b>Rating:</b> " + rating + "</p>"
+        + "<p style='margin: 2px 0;'><b>Minimum nights:</b> " + data.minimum_nights[i] + "</p>"
+        + "</div>"
+        + "<a href='" + escape(data.listing_url[i]) + "' target='_blank' style='color: #007BFF; text-decoration: none; display: inline-block; margin-bottom: 10px;'>View on Airbnb</a>"
+        + "<div style='width: 80%; height: 200px; overflow: hidden; border-radius: 10px; box-shadow: 0 2px 8px rgba(0, 0, 0, 0.1); display: flex; justify-content: center'>"
+        + "<img src='" + escape(data.picture_url[i]) + "' alt='Listing image' style='height: 100%; width: 100%; object-fit: cover; border-radius: 10px;'>"
+        + "</div></div>";
+}
 
+function marker(i) {
+    var marker = L.circleMarker([data.latitude[i], data.longitude[i]], {
+        radius: 5,
+        fill: true,
+        fillOpacity: 1,
+        color: data.colors[data.color[i]],
+    });
+    marker.bindPopup(popup.bind(null, i), {maxWidth: 400});
+    return marker;
+}
+"""  # noqa: E501
+
+
+class ListingsLayer(MacroElement):
+    """Circle markers for all listings, built in the browser from one payload.
+
+    The listing attributes are sent once as column arrays and every marker is
+    created client-side and added to the sub-group of its room type. Popups are
+    only rendered when a marker is clicked.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            (function(){
+                var data = {{ this.data|tojson }};
+                var groups = [
+                    {%- for group in this.groups %}
+                    {{ group.get_name() }},
+                    {%- endfor %}
+                ];
+
+                {{ this.marker_js }}
+
+                for (var i = 0; i < data.latitude.length; i++) {
+                    marker(i).addTo(groups[data.room_type[i]]);
+                }
+            })();
+        {% endmacro %}
+        """
+    )
+
+    marker_js = LISTING_MARKER_JS
+
+    def __init__(self, data: pd.DataFrame, groups: dict, price_scale):
+        super().__init__()
+        self._name = "ListingsLayer"
+
+        room_type = pd.Categorical(data["room_type"], categories=list(groups))
+        neighbourhood = pd.Categorical(data["neighbourhood_cleansed"])
+
+        self.groups = list(groups.values())
+        self.data = {
+            "latitude": data["latitude"].round(6).tolist(),
+            "longitude": data["longitude"].round(6).tolist(),
+            "price": data["price"].astype(float).round(2).tolist(),
+            "color": price_steps(data["price"], price_scale).tolist(),
+            "colors": [price_scale.rgb_hex_str(x) for x in price_scale.index[:-1]],
+            "room_type": room_type.codes.tolist(),
+            "room_types": room_type.categories.tolist(),
+            "neighbourhood": neighbourhood.codes.tolist(),
+            "neighbourhoods": neighbourhood.categories.tolist(),
+            "name": data["name"].fillna("").tolist(),
+            "rating": data["review_scores_rating"]
+            .astype(float)
+            .round(2)
+            .astype(object)
+            .where(data["review_scores_rating"].notna(), None)
+            .tolist(),
+            "minimum_nights": data["minimum_nights"].tolist(),
+            "listing_url": data["listing_url"].fillna("").tolist(),
+            "picture_url": data["picture_url"].fillna("").tolist(),
+        }
+
+
+class HexbinLayer(ListingsLayer):
+    """Hexagonal cells summarizing the listings, with markers when zoomed in.
+
+    Below `switch_zoom` the map shows one polygon per cell, colored by the
+    median price of its listings. From `switch_zoom` on, the cells are hidden
+    and markers are created only for the listings inside the visible bounds.
+    Past `max_points` listings, the markers are a random sample of them and
+    a note on the map says so.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            (function(){
+                var map = {{ this._parent.get_name() }};
+                var data = {{ this.data|tojson }};
+                var cells = {{ this.cells|tojson }};
+                var groups = [
+                    {%- for group in this.groups %}
+                    {{ group.get_name() }},
+                    {%- endfor %}
+                ];
+
+                {{ this.marker_js }}
+
+                function cellPopup(j) {
+                    var html = "<div style='font-family: Helvetica, Arial, sans-serif;'>"
+                        + "<b>" + cells.count[j] + " listings</b><br>"
+                        + "Median price: $" + cells.median_price[j];
+                    for (var k = 0; k < data.room_types.length; k++) {
+                        var share = Math.round(100 * cells.room_type_mix[k][j]);
+                        if (share > 0) {
+                            html += "<br>" + escape(data.room_types[k]) + ": " + share + "%";
+                        }
+                    }
+                    return html + "</div>";
+                }
+
+                var hexagons = L.featureGroup();
+                for (var j = 0; j < cells.latitude.length; j++) {
+                    var corners = [];
+                    for (var c = 0; c < 6; c++) {
+                        var angle = Math.PI / 180 * (60 * c - 30);
+                        corners.push([
+                            cells.latitude[j] + cells.size * Math.sin(angle),
+                            cells.longitude[j] + cells.size * Math.cos(angle) / cells.scale,
+                        ]);
+                    }
+                    L.polygon(corners, {
+                        color: data.colors[cells.color[j]],
+                        weight: 1,
+                        fillOpacity: 0.6,
+                    }).bindPopup(cellPopup.bind(null, j)).addTo(hexagons);
+                }
+
+                var markers = [];
+                function update() {
+                    var zoomed = map.getZoom() >= {{ this.switch_zoom }};
+                    if (zoomed) {
+                        map.removeLayer(hexagons);
+                    } else {
+                        hexagons.addTo(map);
+                    }
+
+                    groups.forEach(function (group) { group.clearLayers(); });
+                    if (!zoomed) {
+                        return;
+                    }
+
+                    var bounds = map.getBounds();
+                    for (var i = 0; i < data.latitude.length; i++) {
+                        if (bounds.contains([data.latitude[i], data.longitude[i]])) {
+                            markers[i] = markers[i] || marker(i);
+                            markers[i].addTo(groups[data.room_type[i]]);
+                        }
+                    }
+                }
+
+                map.on("zoomend moveend", update);
+                update();
+                {%- if this.sampled %}
+
+                var note = L.control({position: "bottomleft"});
+                note.onAdd = function () {
+                    var div = L.DomUtil.create("div", "leaflet-control-attribution");
+                    div.innerHTML = {{ this.sampled|tojson }};
+                    return div;
+                };
+                note.addTo(map);
+                {%- endif %}
+            })();
+        {% endmacro %}
+        """  # noqa: E501
+    )
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        groups: dict,
+        price_scale,
+        size_m: float = 500,
+        switch_zoom: int = 15,
+        max_points: int = 20000,
+    ):
+        # Only a bounded sample of listings is embedded for the zoomed-in view,
+        # which the map then says. The cells count every listing
+        points = data
+        self.sampled = None
+        if data.shape[0] > max_points:
+            points = data.sample(n=max_points, random_state=6954)
+            self.sampled = (
+                f"Zoomed in, the markers are a random sample of {max_points:,} "
+                f"of the {data.shape[0]:,} listings"
+            )
+
+        super().__init__(points, groups, price_scale)
+        self._name = "HexbinLayer"
+
+        origin_latitude = data["latitude"].mean()
+        cells = spatial.aggregate_hexbins(data, size_m, origin_latitude)
+
+        self.switch_zoom = switch_zoom
+        self.cells = {
+            "size": size_m / spatial.METERS_PER_DEGREE,
+            "scale": float(np.cos(np.radians(origin_latitude))),
+            "latitude": cells["latitude"].round(6).tolist(),
+            "longitude": cells["longitude"].round(6).tolist(),
+            "count": cells["count"].tolist(),
+            "median_price": cells["median_price"].astype(float).round(2).tolist(),
+            "color": price_steps(cells["median_price"], price_scale).tolist(),
+            "room_type_mix": [
+                cells[room_type].round(3).tolist()
+                if room_type in cells
+                else [0] * cells.shape[0]
+                for room_type in groups
+            ],
+        }
+
+
+def add_listing_markers(data: pd.DataFrame, groups: dict, price_scale):
     for idx, row in data.iterrows():
         popup_html = f"""
         <div style='font-family: Helvetica, Arial, sans-serif;'>
@@ -423,11 +618,73 @@ def visualize_on_map(data: pd.DataFrame):
             color=price_scale(row["price"]),
         )
 
-        marker.add_to(room_type[row["room_type"]])
+        marker.add_to(groups[row["room_type"]])
+
+
+@cache.cached("maps")
+def visualize_on_map(dataset: ingest.Dataset, mode: str = "hexbin"):
+    """Render the listings map to HTML.
+
+    `mode` is "hexbin" to show hexagonal price cells at city level and markers
+    for the visible listings when zoomed in, "fast" to cluster markers for all
+    listings built in the browser from a compact payload, or "markers" to
+    serialize one folium marker and popup per listing.
+    """
+    data = dataset.data
+
+    map = folium.Map(
+        location=[data["latitude"].mean(), data["longitude"].mean()],
+        zoom_start=12,
+        max_zoom=20,
+        tiles=None,
+    )
+
+    folium.TileLayer("cartodbpositron", opacity=1, control=False).add_to(map)
+
+    # Create a color scale based on the price of listings in data
+    vmin = data["price"].quantile(0.05)
+    vmax = data["price"].quantile(0.95)
+
+    colors = ["green", "lightgreen", "yellow", "orange", "red"]
+    price_scale = branca.colormap.LinearColormap(
+        colors,
+        vmin=vmin,
+        vmax=vmax,
+        caption="Price",
+        index=[
+            vmin,
+            (vmin + vmax) / 4,
+            (vmin + vmax) / 2,
+            3 * (vmin + vmax) / 4,
+            vmax,
+        ],
+    )
+
+    price_scale = price_scale.to_step(15)
+
+    price_scale.add_to(map)
+
+    listings_group = plugins.MarkerCluster(name="Listings", control=False)
+    map.add_child(listings_group)
+
+    room_type = {}
+    for r_type in data["room_type"].unique():
+        room_type[r_type] = plugins.FeatureGroupSubGroup(listings_group, name=r_type)
+
+    if mode == "markers":
+        add_listing_markers(data, room_type, price_scale)
+    elif mode not in ("fast", "hexbin"):
+        raise ValueError(f"Unknown map mode: {mode}")
 
     for group in room_type.values():
         map.add_child(group)
 
+    # The layers fill the sub-groups, so they have to come after them in the page
+    if mode == "fast":
+        map.add_child(ListingsLayer(data, room_type, price_scale))
+    elif mode == "hexbin":
+        map.add_child(HexbinLayer(data, room_type, price_scale))
+
     map.add_child(
         plugins.MiniMap(
             tile_layer="cartodbpositron", toggle_display=True, minimized=True
@@ -436,4 +693,9 @@ def visualize_on_map(data: pd.DataFrame):
     map.add_child(folium.LayerControl(collapsed=False))
     map.add_child(plugins.Fullscreen())
 
-    return map._repr_html_()
+    with tracing.span("plots.render_map"):
+        html = map.get_root().render()
+
+    tracing.annotate(mode=mode, listings=data.shape[0], html_mb=len(html) / 1e6)
+
+    return html
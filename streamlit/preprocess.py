@@ -1,77 +1,139 @@
-import streamlit as st
+from dataclasses import dataclass
+
 import pandas as pd
+import numpy as np
+from scipy import sparse
 
+import tracing as tracing
 
-@st.cache_data(persist=True)
-def preprocess(data: pd.DataFrame) -> pd.DataFrame:
-    object_to_dtype = {
-        "host_since": "datetime64[ns]",
-        "host_response_rate": "float",
-        "host_acceptance_rate": "float",
-        "host_is_superhost": "bool",
-        "host_has_profile_pic": "bool",
-        "host_identity_verified": "bool",
-        "instant_bookable": "bool",
-        "has_availability": "bool",
-    }
-
-    for col, dtype in object_to_dtype.items():
-        if dtype == "float":
-            data[col] = data[col].str.replace("%", "").astype(dtype)
-        elif dtype == "bool":
-            data[col] = data[col].map({"t": True, "f": False}).astype(dtype)
-        elif dtype == "datetime64[ns]":
-            data[col] = pd.to_datetime(data[col])
-        else:
-            raise ValueError(f"Unknown dtype: {dtype}")
-
-    data["price"] = data["price"].str.replace(r"[\$|,]", "", regex=True).astype(float)
-    data["amenities"] = data["amenities"].str.replace(r"\[|\]|\"", "")
-
-    data_cleaned = data[
-        (data["price"] < data["price"].quantile(0.95)) & (data["minimum_nights"] <= 365)
-    ]
-
-    # Extract numerical value from `bathrooms_text` column
-    data_cleaned["bathrooms"] = (
-        data["bathrooms_text"].str.extract("(\d+\.?\d*)", expand=False).astype(float)
-    )
 
-    # Create new column `bathrooms_is_shared` indicating if bathroom is shared or not
-    data_cleaned["bathrooms_is_shared"] = data["bathrooms_text"].str.contains(
-        "shared", case=False
-    )
+@dataclass
+class Amenities:
+    """Sparse listing x amenity matrix with its vocabulary.
 
-    # Fill NAs for bedrooms with median value of bedrooms by neighbourhood
-    data_cleaned["bedrooms"] = data_cleaned.groupby("neighbourhood_cleansed")[
-        "bedrooms"
-    ].transform(lambda x: x.fillna(x.median()))
-
-    list_of_amenities = (
-        data_cleaned["amenities"]
-        .str.split(", ")
-        .explode()
-        .value_counts()
-        .to_frame()
-        .reset_index()
-    )
+    Columns are ordered by the number of listings offering the amenity, most
+    common first, so the top `n` amenities are the first `n` columns.
+    """
 
-    top_20_amenities = list_of_amenities.head(20)["index"].to_list()
+    vocabulary: np.ndarray
+    counts: np.ndarray
+    matrix: sparse.csr_matrix
 
-    data_cleaned["num_amenities"] = (
-        data_cleaned["amenities"]
-        .apply(lambda x: x.split(", "))
-        .apply(lambda y: len(set(y).intersection(set(top_20_amenities))))
-    )
+    def top(self, n: int = 20) -> list:
+        return self.vocabulary[:n].tolist()
+
+    def select(self, rows=slice(None)) -> "Amenities":
+        """Amenities of the listings at positions `rows`, counted and reordered.
+
+        Amenities none of these listings offer are dropped.
+        """
+        matrix = self.matrix[rows]
+        counts = matrix.getnnz(axis=0)
+
+        offered = np.flatnonzero(counts)
+        order = offered[
+            np.lexsort((self.vocabulary[offered].astype(str), -counts[offered]))
+        ]
 
-    amenities_dummies = (
-        data_cleaned["amenities"]
-        .apply(
-            lambda x: ";".join(set(x.split(", ")).intersection(set(top_20_amenities)))
+        return Amenities(self.vocabulary[order], counts[order], matrix[:, order])
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            vocabulary=self.vocabulary.astype(str),
+            counts=self.counts,
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr,
+            shape=self.matrix.shape,
         )
-        .str.get_dummies(sep=";")
+
+    @classmethod
+    def load(cls, path: str) -> "Amenities":
+        with np.load(path) as npz:
+            matrix = sparse.csr_matrix(
+                (npz["data"], npz["indices"], npz["indptr"]), shape=tuple(npz["shape"])
+            )
+            return cls(npz["vocabulary"].astype(object), npz["counts"], matrix)
+
+
+def clean_amenities(amenities: pd.Series) -> pd.Series:
+    """Raw amenities lists ('["Wifi", "Kitchen"]') as "Wifi, Kitchen" strings."""
+    return amenities.str.replace(r"\[|\]|\"", "", regex=True)
+
+
+@tracing.traced
+def tokenize_amenities(amenities: pd.Series) -> Amenities:
+    """Tokenize cleaned amenities strings ("Wifi, Kitchen, ...") in one pass."""
+    tokens = amenities.reset_index(drop=True).str.split(", ").explode()
+    tokens = tokens[tokens.notna() & (tokens != "")]
+
+    codes, vocabulary = pd.factorize(tokens)
+    vocabulary = vocabulary.to_numpy(dtype=str)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(codes), dtype="uint8"), (tokens.index.to_numpy(), codes)),
+        shape=(len(amenities), len(vocabulary)),
     )
 
-    data_cleaned = pd.concat([data_cleaned, amenities_dummies], axis=1)
+    # Amenities listed twice by the same listing are counted once
+    matrix.data.fill(1)
+    amenities = Amenities(vocabulary.astype(object), matrix.getnnz(axis=0), matrix)
+
+    return amenities.select()
+
+
+@tracing.traced
+def preprocess(data: pd.DataFrame, tokens: Amenities = None) -> tuple:
+    # `data` is expected to be typed by `schema.read_listings`. The result is
+    # cached on disk by `ingest`, keyed on the source file hash. `tokens` are
+    # the amenities of every listing of `data`, tokenized here when not given
+    if tokens is None:
+        tokens = tokenize_amenities(clean_amenities(data["amenities"]))
+
+    with tracing.span("preprocess.outliers"):
+        data_cleaned = data[
+            (data["price"] < data["price"].quantile(0.95))
+            & (data["minimum_nights"] <= 365)
+        ]
+
+        # Drop categories of listings removed as outliers
+        for col in data_cleaned.select_dtypes("category").columns:
+            data_cleaned[col] = data_cleaned[col].cat.remove_unused_categories()
+
+    with tracing.span("preprocess.bathrooms"):
+        # Extract numerical value from `bathrooms_text` column
+        data_cleaned["bathrooms"] = (
+            data["bathrooms_text"]
+            .str.extract("(\d+\.?\d*)", expand=False)
+            .astype(float)
+        )
+
+        # New column `bathrooms_is_shared` indicating if bathroom is shared or not
+        data_cleaned["bathrooms_is_shared"] = data["bathrooms_text"].str.contains(
+            "shared", case=False
+        )
+
+    with tracing.span("preprocess.bedrooms"):
+        # Fill NAs for bedrooms with median value of bedrooms by neighbourhood
+        data_cleaned["bedrooms"] = data_cleaned.groupby("neighbourhood_cleansed")[
+            "bedrooms"
+        ].transform(lambda x: x.fillna(x.median()))
+
+    with tracing.span("preprocess.amenities"):
+        # Dummies for the top 20 amenities and the number of them offered
+        amenities = tokens.select(data.index.get_indexer(data_cleaned.index))
+        top_20_amenities = amenities.matrix[:, :20]
+
+        data_cleaned["num_amenities"] = top_20_amenities.getnnz(axis=1)
+
+        amenities_dummies = pd.DataFrame(
+            top_20_amenities.toarray(),
+            index=data_cleaned.index,
+            columns=amenities.top(20),
+        )
+
+        data_cleaned = pd.concat(
+            [data_cleaned.drop(columns="amenities"), amenities_dummies], axis=1
+        )
 
-    return data_cleaned
+    return data_cleaned, amenities
@@ -0,0 +1,246 @@
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import artifacts as artifacts
+import features as features
+import ingest as ingest
+import preprocess as preprocess
+import schema as schema
+
+# Population stability index from which a column counts as drifted. Below 0.1
+# is usually read as no shift, 0.1 to 0.2 as a moderate one.
+DRIFT_THRESHOLD = 0.2
+
+# Quantile bins of numeric columns, columns with fewer values are compared
+# value by value
+DRIFT_BINS = 10
+
+# Columns of the preprocessed listings compared between two scrapes
+DRIFT_COLUMNS = (
+    ["price"]
+    + features.NUMERIC_COLUMNS
+    + list(features.DERIVED_DTYPES)
+    + ["neighbourhood_cleansed", "room_type"]
+)
+
+# Fewest trees replaced when the model of a drifted city is refreshed
+MIN_NEW_TREES = 10
+
+
+def psi(expected: pd.Series, actual: pd.Series, bins: int = DRIFT_BINS) -> float:
+    """Population stability index of `actual` against `expected`."""
+    expected, actual = expected.dropna(), actual.dropna()
+    if expected.empty or actual.empty:
+        return 0.0
+
+    if expected.nunique() <= bins or not pd.api.types.is_numeric_dtype(expected):
+        e, a = (
+            expected.astype(object)
+            .value_counts(normalize=True)
+            .align(actual.astype(object).value_counts(normalize=True), fill_value=0)
+        )
+        e, a = e.to_numpy(), a.to_numpy()
+    else:
+        edges = np.unique(np.quantile(expected, np.linspace(0, 1, bins + 1)[1:-1]))
+        e, a = (
+            np.bincount(
+                np.searchsorted(edges, x, side="right"), minlength=edges.size + 1
+            )
+            / x.size
+            for x in (expected.to_numpy(), actual.to_numpy())
+        )
+
+    # Empty bins would make the index infinite
+    e, a = np.clip(e, 1e-4, None), np.clip(a, 1e-4, None)
+
+    return float(np.sum((a - e) * np.log(a / e)))
+
+
+def drift(previous: pd.DataFrame, current: pd.DataFrame) -> dict:
+    """Population stability index of every `DRIFT_COLUMNS` between two scrapes."""
+    return {col: psi(previous[col], current[col]) for col in DRIFT_COLUMNS}
+
+
+def splice_tokens(
+    tokens: preprocess.Amenities,
+    positions: np.ndarray,
+    unchanged: np.ndarray,
+    fresh: preprocess.Amenities,
+) -> preprocess.Amenities:
+    """Amenity tokens of a new scrape from those of the last one.
+
+    Unchanged listings keep their row of `tokens`, found at `positions`, and
+    the other listings take the rows of `fresh`, tokenized from them alone.
+    Amenities new to the city are appended to the vocabulary.
+    """
+    vocabulary = pd.Index(tokens.vocabulary).append(pd.Index(fresh.vocabulary))
+    vocabulary = vocabulary.unique()
+
+    kept = tokens.matrix[positions[unchanged]]
+    kept = sparse.csr_matrix(
+        (kept.data, kept.indices, kept.indptr), shape=(kept.shape[0], vocabulary.size)
+    )
+    added = sparse.csr_matrix(
+        (
+            fresh.matrix.data,
+            vocabulary.get_indexer(fresh.vocabulary)[fresh.matrix.indices],
+            fresh.matrix.indptr,
+        ),
+        shape=(fresh.matrix.shape[0], vocabulary.size),
+    )
+
+    # Back to the order of the listings in the new scrape
+    rows = np.concatenate([np.flatnonzero(unchanged), np.flatnonzero(~unchanged)])
+    matrix = sparse.vstack([kept, added], format="csr")[np.argsort(rows)]
+
+    return preprocess.Amenities(
+        vocabulary.to_numpy(dtype=object), matrix.getnnz(axis=0), matrix
+    ).select()
+
+
+def refresh_model(city: str, listings: pd.DataFrame, share: float) -> int:
+    """Replace a `share` of the trees of a city model by trees of `listings`.
+
+    The new trees are grown by warm start on the changed `listings` alone and
+    the oldest trees are dropped, so the forest keeps its size and the cost
+    follows the number of changed listings. Returns the number of trees
+    replaced. Categories and amenities new since the model was trained are
+    ignored until it is trained again by `train`.
+    """
+    start = time.perf_counter()
+    model = joblib.load(artifacts.model_path(city))
+    spec = artifacts.load_schema(city)
+    pipeline = model["model"]
+    forest = pipeline.named_steps["model"]
+
+    encoded = features.encode_listings(listings, spec)
+    if hasattr(pipeline, "feature_names_in_"):
+        encoded = pd.DataFrame(encoded, columns=spec.feature_names)
+    X, y = pipeline[:-1].transform(encoded), np.log(listings["price"].to_numpy())
+
+    n_trees = len(forest.estimators_)
+    new_trees = min(n_trees, max(MIN_NEW_TREES, round(n_trees * share)))
+    forest.set_params(
+        n_estimators=n_trees + new_trees, warm_start=True, oob_score=False
+    )
+    forest.fit(X, y)
+    forest.estimators_ = forest.estimators_[new_trees:]
+    forest.set_params(n_estimators=n_trees, warm_start=False)
+
+    # Moved in place once complete, as the app reloads it as soon as it changes
+    with artifacts.replace_file(artifacts.model_path(city)) as path:
+        joblib.dump(model, path, compress=True)
+    artifacts.convert_model(city)
+
+    print(
+        f"Model for {city} refreshed in {time.perf_counter() - start:.2f}s, "
+        f"{new_trees} of {n_trees} trees fitted on {len(listings)} listings."
+    )
+
+    return new_trees
+
+
+def refresh(city: str, threshold: float = DRIFT_THRESHOLD) -> dict:
+    """Bring the cache of a city, and its model if it drifted, up to date.
+
+    The new scrape is diffed against the last one on the listing `id`, and
+    only the amenities of added and changed listings are tokenized again. The
+    model is refreshed when the population stability index of any
+    `DRIFT_COLUMNS` reaches `threshold`. Returns the manifest of the cache.
+    """
+    file = ingest.city_file(city)
+    manifest = ingest.read_manifest(file)
+    if ingest.is_fresh(file, manifest):
+        print(f"Cache for {file} is up to date.")
+        return manifest
+
+    rows_path, tokens_path = ingest.snapshot_paths(file)
+    if manifest.get("version") != ingest.CACHE_VERSION or not (
+        os.path.exists(rows_path) and os.path.exists(tokens_path)
+    ):
+        print(f"No snapshot of {file} to diff against, building its cache.")
+        return ingest.build(file)
+
+    start = time.perf_counter()
+    previous, _ = ingest.read_cache(file, columns=DRIFT_COLUMNS)
+    tokens = preprocess.Amenities.load(tokens_path)
+    with np.load(rows_path) as rows:
+        ids, hashes = rows["id"], rows["hash"]
+
+    data = schema.read_listings(os.path.join(ingest.DATA_DIR, file))
+    positions = pd.Index(ids).get_indexer(data["id"])
+    unchanged = positions >= 0
+    unchanged[unchanged] = (
+        hashes[positions[unchanged]] == ingest.row_hashes(data)[unchanged]
+    )
+    changed = data[~unchanged]
+
+    fresh = preprocess.tokenize_amenities(
+        preprocess.clean_amenities(changed["amenities"])
+    )
+    tokens = splice_tokens(tokens, positions, unchanged, fresh)
+    manifest = ingest.build(file, data, tokens)
+
+    current, _ = ingest.read_cache(file, columns=DRIFT_COLUMNS + ["id"])
+    scores = drift(previous, current)
+    drifted = sorted(col for col, score in scores.items() if score >= threshold)
+
+    added = int(np.sum(positions < 0))
+    report = {
+        "added": added,
+        "changed": int(changed.shape[0]) - added,
+        "removed": int(ids.size - np.sum(positions >= 0)),
+        "drift": scores,
+        "drifted": drifted,
+        "trees_replaced": 0,
+    }
+    print(
+        f"{file}: {report['added']} added, {report['changed']} changed and "
+        f"{report['removed']} removed listings, "
+        f"drifted: {', '.join(drifted) or 'none'}."
+    )
+
+    # Listings the model is trained on: kept by `preprocess`, with bathrooms
+    listings = changed[
+        changed["id"].isin(current["id"]) & changed["bathrooms_text"].notna()
+    ]
+    if drifted and len(listings) and os.path.exists(artifacts.model_path(city)):
+        report["trees_replaced"] = refresh_model(
+            city, listings, changed.shape[0] / data.shape[0]
+        )
+
+    manifest["refresh"] = report
+    ingest.write_manifest(file, manifest)
+
+    print(f"Refreshed {file} in {time.perf_counter() - start:.2f}s.")
+
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Refresh the cache and, if their listings drifted, the models of cities whose data changed."  # noqa: E501
+    )
+    parser.add_argument(
+        "cities", nargs="*", help="Cities to refresh (default: all of them)"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DRIFT_THRESHOLD,
+        help="Population stability index from which a column counts as drifted "
+        f"and the model is refreshed (default: {DRIFT_THRESHOLD})",
+    )
+    args = parser.parse_args()
+
+    cities = args.cities or sorted(
+        file.split(".")[0] for file in os.listdir(ingest.DATA_DIR)
+    )
+    for city in cities:
+        refresh(city, args.threshold)
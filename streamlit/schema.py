@@ -0,0 +1,111 @@
+import pandas as pd
+
+import tracing as tracing
+
+
+def parse_flag(series: pd.Series) -> pd.Series:
+    # Missing flags read as True, as in the training notebook
+    return series.ne("f")
+
+
+def parse_percent(series: pd.Series) -> pd.Series:
+    return series.str.rstrip("%").astype("float32")
+
+
+def parse_currency(series: pd.Series) -> pd.Series:
+    return series.str.replace(r"[\$,]", "", regex=True).astype("float32")
+
+
+def parse_date(series: pd.Series) -> pd.Series:
+    return pd.to_datetime(series)
+
+
+# Raw listing columns consumed by `preprocess`, `plots` and `model`, with the
+# dtype the CSV reader parses them as. Free text columns of the Inside Airbnb
+# dump (description, host_about, neighborhood_overview, ...) are never read.
+LISTING_DTYPES = {
+    "id": "int64",
+    "listing_url": "object",
+    "name": "object",
+    "picture_url": "object",
+    "host_since": "object",
+    "host_response_time": "category",
+    "host_response_rate": "object",
+    "host_acceptance_rate": "object",
+    "host_is_superhost": "category",
+    "host_listings_count": "float32",
+    "host_verifications": "category",
+    "host_has_profile_pic": "category",
+    "host_identity_verified": "category",
+    "neighbourhood_cleansed": "category",
+    "latitude": "float64",
+    "longitude": "float64",
+    "room_type": "category",
+    "accommodates": "int32",
+    "bathrooms_text": "category",
+    "bedrooms": "float32",
+    "beds": "float32",
+    "amenities": "object",
+    "price": "object",
+    "minimum_nights": "int32",
+    "maximum_nights": "int32",
+    "has_availability": "category",
+    "availability_365": "int32",
+    "review_scores_rating": "float32",
+    "instant_bookable": "category",
+}
+
+# Columns that need more than the CSV reader to reach their final dtype. Each
+# parser is vectorized and runs once over the whole column after reading.
+LISTING_PARSERS = {
+    "host_since": parse_date,
+    "host_response_rate": parse_percent,
+    "host_acceptance_rate": parse_percent,
+    "host_is_superhost": parse_flag,
+    "host_has_profile_pic": parse_flag,
+    "host_identity_verified": parse_flag,
+    "has_availability": parse_flag,
+    "instant_bookable": parse_flag,
+    "price": parse_currency,
+}
+
+
+def parse_listings(data: pd.DataFrame, columns: list = None) -> pd.DataFrame:
+    """Project a raw listings frame to the schema columns and convert dtypes.
+
+    `columns` selects a subset of the schema columns, all of them by default.
+    """
+    columns = list(LISTING_DTYPES) if columns is None else columns
+    data = data.loc[:, columns]
+
+    for col in columns:
+        if data[col].dtype != LISTING_DTYPES[col]:
+            data[col] = data[col].astype(LISTING_DTYPES[col])
+
+        if col in LISTING_PARSERS:
+            data[col] = LISTING_PARSERS[col](data[col])
+
+    return data
+
+
+@tracing.traced
+def read_listings(path, columns: list = None, **kwargs) -> pd.DataFrame:
+    """Read an Inside Airbnb listings CSV with the declared schema.
+
+    `columns` selects a subset of the schema columns, all of them by default.
+    """
+    columns = list(LISTING_DTYPES) if columns is None else columns
+    data = pd.read_csv(
+        path,
+        usecols=columns,
+        dtype={col: LISTING_DTYPES[col] for col in columns},
+        **kwargs,
+    )
+
+    for col in columns:
+        if col in LISTING_PARSERS:
+            data[col] = LISTING_PARSERS[col](data[col])
+
+    tracing.annotate(rows=data.shape[0])
+
+    return data
@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tornado.web
+
+import cache as cache
+import ingest as ingest
+import model as model
+import tracing as tracing
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+# Upper bounds of the batch size histogram buckets, in rows
+BATCH_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+
+
+class Histogram:
+    """Counts of observations per bucket, with the upper bounds `bounds`."""
+
+    def __init__(self, bounds: list):
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.counts = np.zeros(self.bounds.size + 1, dtype=np.int64)
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[np.searchsorted(self.bounds, value)] += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the `q` quantile.
+
+        None when it falls past the last bound.
+        """
+        count = self.counts.sum()
+        if not count:
+            return 0.0
+
+        bucket = np.searchsorted(np.cumsum(self.counts), q * count)
+        return float(self.bounds[bucket]) if bucket < self.bounds.size else None
+
+    def to_dict(self) -> dict:
+        count = int(self.counts.sum())
+        return {
+            "count": count,
+            "mean": self.total / count if count else 0.0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(
+                zip(
+                    [f"{bound:g}" for bound in self.bounds] + ["+Inf"],
+                    self.counts.tolist(),
+                )
+            ),
+        }
+
+
+class MicroBatcher:
+    """Coalesce the concurrent predictions of a city into batched forest calls.
+
+    Rows submitted while a batch fills are scored together once it holds
+    `max_batch_size` rows or its first rows waited `max_wait` seconds,
+    whichever comes first. Batches are scored on `executor`, so the event
+    loop keeps filling the next one meanwhile.
+    """
+
+    def __init__(self, city: str, max_batch_size: int, max_wait: float, executor):
+        self.city = city
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+
+        self.rows, self.futures, self.size = [], [], 0
+        self.timer = None
+
+        self.latency = Histogram(LATENCY_BUCKETS_MS)
+        self.batch_latency = Histogram(LATENCY_BUCKETS_MS)
+        self.batch_size = Histogram(BATCH_BUCKETS)
+
+    async def predict(self, X: np.ndarray) -> np.ndarray:
+        """Log prices of the encoded listings `X`, scored in the next batch."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        self.rows.append(X)
+        self.futures.append(future)
+        self.size += X.shape[0]
+
+        if self.size >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        rows, futures = self.rows, self.futures
+        self.rows, self.futures, self.size = [], [], 0
+
+        scored = asyncio.get_running_loop().run_in_executor(
+            self.executor, self.score, np.vstack(rows)
+        )
+        scored.add_done_callback(lambda done: self.resolve(done, rows, futures))
+
+    def score(self, X: np.ndarray) -> np.ndarray:
+        start = time.perf_counter()
+        rf, _ = model.load_model(self.city)
+        predictions = model.predict_rows(rf, X, self.city)
+
+        self.batch_latency.observe((time.perf_counter() - start) * 1e3)
+        self.batch_size.observe(X.shape[0])
+
+        return predictions
+
+    def resolve(self, done: asyncio.Future, rows: list, futures: list):
+        error = done.exception()
+        if error is None:
+            ends = np.cumsum([X.shape[0] for X in rows])
+            parts = np.split(done.result(), ends[:-1])
+
+        for i, future in enumerate(futures):
+            # Requests whose client went away are cancelled
+            if future.done():
+                continue
+
+            if error is None:
+                future.set_result(parts[i])
+            else:
+                future.set_exception(error)
+
+    def stats(self) -> dict:
+        return {
+            "latency_ms": self.latency.to_dict(),
+            "batch_latency_ms": self.batch_latency.to_dict(),
+            "batch_size": self.batch_size.to_dict(),
+        }
+
+
+class JSONHandler(tornado.web.RequestHandler):
+    """Handler answering errors with `{"error": message}`."""
+
+    def initialize(self, batchers: dict):
+        self.batchers = batchers
+
+    def write_error(self, status_code: int, **kwargs):
+        # The details are kept out of the status line, which only takes latin-1
+        _, error, _ = kwargs.get("exc_info", (None, None, None))
+        if isinstance(error, tornado.web.HTTPError) and error.log_message:
+            self.finish({"error": error.log_message % error.args})
+        else:
+            self.finish({"error": self._reason})
+
+    async def load_model(self, batcher: MicroBatcher) -> tuple:
+        # Reloading a changed artifact would block every request on the loop,
+        # only cache misses go through the executor
+        loaded = model.loaded_model(batcher.city)
+        if loaded is None:
+            loaded = await asyncio.get_running_loop().run_in_executor(
+                None, model.load_model, batcher.city
+            )
+        return loaded
+
+
+class PredictHandler(JSONHandler):
+    """Predict the nightly price of one listing, or of a list of listings."""
+
+    async def post(self, city: str):
+        start = time.perf_counter()
+        batcher = self.batchers.get(city.capitalize())
+        if batcher is None:
+            raise tornado.web.HTTPError(404, "No model for %s", city)
+
+        _, spec = await self.load_model(batcher)
+        try:
+            listings = json.loads(self.request.body)
+            X = np.vstack(
+                [
+                    spec.encode_attributes(listing)
+                    for listing in (
+                        listings if isinstance(listings, list) else [listings]
+                    )
+                ]
+            )
+        except (ValueError, TypeError, AttributeError) as error:
+            raise tornado.web.HTTPError(400, "Invalid listing: %s", error)
+
+        prices = np.exp(await batcher.predict(X))
+
+        response = {
+            "city": batcher.city,
+            "currency": model.tickprefixes_city[batcher.city],
+        }
+        if isinstance(listings, list):
+            response["prices"] = prices.tolist()
+        else:
+            response["price"] = prices.item()
+        self.write(response)
+
+        batcher.latency.observe((time.perf_counter() - start) * 1e3)
+
+
+class WhatIfHandler(JSONHandler):
+    """Price change of one listing under every what-if variant, best first."""
+
+    async def post(self, city: str):
+        batcher = self.batchers.get(city.capitalize())
+        if batcher is None:
+            raise tornado.web.HTTPError(404, "No model for %s", city)
+
+        rf, spec = await self.load_model(batcher)
+        try:
+            row = spec.encode_attributes(json.loads(self.request.body))
+        except (ValueError, TypeError, AttributeError) as error:
+            raise tornado.web.HTTPError(400, "Invalid listing: %s", error)
+
+        # All the variants are one forest call, scored off the event loop
+        table = await asyncio.get_running_loop().run_in_executor(
+            batcher.executor, model.what_if, rf, spec, row, batcher.city
+        )
+
+        self.write(
+            {
+                "city": batcher.city,
+                "currency": model.tickprefixes_city[batcher.city],
+                "variants": table.to_dict(orient="records"),
+            }
+        )
+
+
+class MetricsHandler(JSONHandler):
+    """Latency histograms of every city, cache and traced stage counters."""
+
+    def get(self):
+        metrics = {city: batcher.stats() for city, batcher in self.batchers.items()}
+        metrics["predictions"] = cache.CACHES["predictions"].stats()
+        metrics["stages"] = tracing.summary()
+        self.write(metrics)
+
+
+def make_app(
+    cities: list, max_batch_size: int = 64, max_wait_ms: float = 2, threads: int = 1
+) -> tornado.web.Application:
+    """Prediction service of `cities`, whose models are loaded up front."""
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="predict")
+
+    batchers = {}
+    for city in cities:
+        city = city.capitalize()
+        model.load_model(city)
+        batchers[city] = MicroBatcher(city, max_batch_size, max_wait_ms / 1e3, executor)
+
+    handlers = {"batchers": batchers}
+    return tornado.web.Application(
+        [
+            (r"/predict/([^/]+)", PredictHandler, handlers),
+            (r"/what-if/([^/]+)", WhatIfHandler, handlers),
+            (r"/metrics", MetricsHandler, handlers),
+        ]
+    )
+
+
+async def serve(app: tornado.web.Application, port: int):
+    app.listen(port)
+    print(f"Serving predictions on http://localhost:{port}/predict/<city>.")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the price models of every city in the data folder over HTTP."  # noqa: E501
+    )
+    parser.add_argument(
+        "cities", nargs="*", help="Cities to serve (default: all of them)"
+    )
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=64,
+        help="Rows scored by one forest call at most (default: 64)",
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=2,
+        help="Time a request waits for others to batch with (default: 2)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Threads scoring batches, across all cities (default: 1)",
+    )
+    args = parser.parse_args()
+
+    cities = args.cities or sorted(
+        file.split(".")[0] for file in os.listdir(ingest.DATA_DIR)
+    )
+    app = make_app(cities, args.max_batch_size, args.max_wait_ms, args.threads)
+    asyncio.run(serve(app, args.port))
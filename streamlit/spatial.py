@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+METERS_PER_DEGREE = 111_320
+
+
+def project_km(latitude, longitude, origin_latitude: float) -> np.ndarray:
+    """Planar (x, y) kilometres of points, scaled for `origin_latitude`.
+
+    Within a city the error against the haversine distance is well under 1%.
+    """
+    return np.column_stack(
+        [
+            np.asarray(longitude) * np.cos(np.radians(origin_latitude)),
+            np.asarray(latitude),
+        ]
+    ) * (METERS_PER_DEGREE / 1000)
+
+
+def hex_cells(latitude, longitude, size: float, origin_latitude: float) -> tuple:
+    """Assign points to the pointy-top hexagonal grid they fall in.
+
+    `size` is the hexagon circumradius in degrees of latitude. Longitudes are
+    scaled by the cosine of `origin_latitude` so that cells are regular on the
+    ground. Returns the axial (q, r) coordinates of each point's cell.
+    """
+    x = np.asarray(longitude) * np.cos(np.radians(origin_latitude))
+    y = np.asarray(latitude)
+
+    q = (np.sqrt(3) / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    s = -q - r
+
+    # Round the fractional cube coordinates to the nearest hexagon
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq[fix_q] = -rr[fix_q] - rs[fix_q]
+    rr[fix_r] = -rq[fix_r] - rs[fix_r]
+
+    return rq.astype(int), rr.astype(int)
+
+
+def hex_centers(q, r, size: float, origin_latitude: float) -> tuple:
+    """Latitude and longitude of the centers of the (q, r) hexagons."""
+    x = size * np.sqrt(3) * (np.asarray(q) + np.asarray(r) / 2)
+    y = size * 1.5 * np.asarray(r)
+
+    return y, x / np.cos(np.radians(origin_latitude))
+
+
+def aggregate_hexbins(
+    data: pd.DataFrame, size_m: float = 500, origin_latitude: float = None
+) -> pd.DataFrame:
+    """Bin listings into hexagons of `size_m` meters and summarize each cell.
+
+    One row per non-empty cell with the listing count, the median price, the
+    share of each room type and the cell center. The grid is scaled for
+    `origin_latitude`, the mean latitude of the listings by default.
+    """
+    if origin_latitude is None:
+        origin_latitude = data["latitude"].mean()
+
+    size = size_m / METERS_PER_DEGREE
+
+    q, r = hex_cells(data["latitude"], data["longitude"], size, origin_latitude)
+    cells = pd.DataFrame(
+        {
+            "q": q,
+            "r": r,
+            "price": data["price"].to_numpy(),
+            "room_type": data["room_type"].to_numpy(),
+        }
+    )
+
+    summary = cells.groupby(["q", "r"])["price"].agg(
+        count="size", median_price="median"
+    )
+    room_type_mix = pd.crosstab(
+        [cells["q"], cells["r"]], cells["room_type"], normalize="index"
+    )
+    summary = summary.join(room_type_mix).reset_index()
+
+    summary["latitude"], summary["longitude"] = hex_centers(
+        summary["q"], summary["r"], size, origin_latitude
+    )
+
+    return summary
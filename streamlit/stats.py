@@ -0,0 +1,86 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import cache as cache
+import ingest as ingest
+
+# Prices kept per group for the box and violin plots, larger groups are sampled
+SAMPLE_SIZE = 5000
+
+# Amenities with a price sample split by whether listings offer them
+NUM_AMENITY_SAMPLES = 11
+
+
+@dataclass
+class CityStats:
+    """Compact per-city summaries the figures of `plots` are built from.
+
+    Each group table has one row per group, sorted by number of listings, with
+    the count, mean and quartiles of the price. `samples` holds the price
+    arrays for the box and violin plots. `fingerprint` is the one of the
+    dataset the stats come from, and is what cached figures are keyed on.
+    """
+
+    fingerprint: str
+    price: np.ndarray
+    neighbourhoods: pd.DataFrame
+    room_types: pd.DataFrame
+    amenities: pd.DataFrame
+    neighbourhood_samples: dict
+    room_type_samples: dict
+    amenity_samples: dict
+
+
+def sample(prices: np.ndarray, size: int = SAMPLE_SIZE) -> np.ndarray:
+    if prices.size <= size:
+        return prices
+
+    return np.random.default_rng(6954).choice(prices, size, replace=False)
+
+
+def summarize(price: pd.Series, groups) -> tuple:
+    """Price summary table and samples of each group in one groupby pass."""
+    grouped = price.groupby(groups, observed=True, sort=False)
+    quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    summary = grouped.agg(["count", "mean"]).join(
+        quartiles.set_axis(["q1", "median", "q3"], axis=1)
+    )
+    summary = summary.sort_values("count", ascending=False, kind="stable")
+
+    samples = {group: sample(prices.to_numpy()) for group, prices in grouped}
+
+    return summary, samples
+
+
+@cache.cached("datasets")
+def compute(dataset: ingest.Dataset) -> CityStats:
+    data, amenities = dataset.data, dataset.amenities
+    price = data["price"]
+
+    neighbourhoods, neighbourhood_samples = summarize(
+        price, data["neighbourhood_cleansed"]
+    )
+    room_types, room_type_samples = summarize(price, data["room_type"])
+
+    table = pd.DataFrame({"amenity": amenities.top(20), "count": amenities.counts[:20]})
+    amenity_samples = {}
+    for amenity in table["amenity"][:NUM_AMENITY_SAMPLES]:
+        offered = data[amenity].to_numpy() == 1
+        amenity_samples[amenity] = {
+            "Yes": sample(price.to_numpy()[offered]),
+            "No": sample(price.to_numpy()[~offered]),
+        }
+
+    return CityStats(
+        dataset.fingerprint,
+        price.to_numpy(),
+        neighbourhoods,
+        room_types,
+        table,
+        # Only the neighbourhoods plotted get a sample
+        {name: neighbourhood_samples[name] for name in neighbourhoods.index[:10]},
+        room_type_samples,
+        amenity_samples,
+    )
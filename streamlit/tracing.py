@@ -0,0 +1,215 @@
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Latest durations kept per stage for the rolling latency summary
+WINDOW = int(os.getenv("TRACE_WINDOW", 200))
+
+# Spans are logged as JSON lines on stderr, those shorter than
+# TRACE_LOG_MIN_MS at DEBUG only (e.g. TRACE_LEVEL=DEBUG to log every span,
+# TRACE_LEVEL=WARNING to log failed spans only)
+LOG_MIN_MS = float(os.getenv("TRACE_LOG_MIN_MS", 1))
+
+logger = logging.getLogger("airbnb.trace")
+logger.setLevel(os.getenv("TRACE_LEVEL", "INFO").upper())
+logger.propagate = False
+if not logger.handlers:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+
+durations = {}
+counters = {}
+lock = threading.Lock()
+
+# Open spans and the rerun collecting the spans opened, per thread
+local = threading.local()
+
+
+class Span:
+    """Timed stage of the app, with attributes logged alongside its duration."""
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.ms = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Rerun:
+    """Spans opened by one thread between `start_rerun` and `end_rerun`."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self.ms = None
+
+
+def stack() -> list:
+    if not hasattr(local, "stack"):
+        local.stack = []
+    return local.stack
+
+
+def record(name: str, ms: float, hit: bool = None, error: bool = False):
+    with lock:
+        if name not in durations:
+            durations[name] = deque(maxlen=WINDOW)
+            counters[name] = {"count": 0, "hits": 0, "misses": 0, "errors": 0}
+
+        durations[name].append(ms)
+        counters[name]["count"] += 1
+        if hit is not None:
+            counters[name]["hits" if hit else "misses"] += 1
+        if error:
+            counters[name]["errors"] += 1
+
+
+def stage_summary(name: str) -> dict:
+    with lock:
+        window = np.fromiter(durations[name], dtype=float)
+        summary = dict(counters[name])
+
+    summary.update(
+        {
+            "p50_ms": float(np.percentile(window, 50)),
+            "p95_ms": float(np.percentile(window, 95)),
+            "max_ms": float(window.max()),
+        }
+    )
+    return summary
+
+
+def summary() -> dict:
+    """Call counts and rolling latency quantiles of every stage."""
+    return {name: stage_summary(name) for name in sorted(durations)}
+
+
+def emit(event: str, name: str, ms: float, level: int, **fields):
+    if logger.isEnabledFor(level):
+        rolling = stage_summary(name)
+        line = {"event": event, "name": name, "ms": round(ms, 3), **fields}
+        line["p50_ms"] = round(rolling["p50_ms"], 3)
+        line["p95_ms"] = round(rolling["p95_ms"], 3)
+        logger.log(level, json.dumps(line, default=str, ensure_ascii=False))
+
+
+def event(name: str, level: int = logging.INFO, **fields):
+    """Log a one-off event, such as a cache eviction, as a JSON line."""
+    if logger.isEnabledFor(level):
+        line = {"event": name, **fields}
+        logger.log(level, json.dumps(line, default=str, ensure_ascii=False))
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as the stage `name`, nested in the open span.
+
+    Attributes set on the span, `hit` for the cached functions, are logged
+    with its duration. Failed blocks are logged with their error.
+    """
+    current = Span(name, attributes)
+    spans = stack()
+
+    # Spans are collected as they open, outermost first
+    rerun = getattr(local, "rerun", None)
+    if rerun is not None:
+        rerun.spans.append((len(spans), current))
+
+    spans.append(current)
+    level = logging.INFO
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as error:
+        current.set(error=repr(error))
+        level = logging.WARNING
+        raise
+    finally:
+        current.ms = (time.perf_counter() - start) * 1e3
+        spans.pop()
+
+        record(
+            current.name,
+            current.ms,
+            current.attributes.get("hit"),
+            level == logging.WARNING,
+        )
+        if current.ms < LOG_MIN_MS and level == logging.INFO:
+            level = logging.DEBUG
+
+        emit(
+            "span",
+            current.name,
+            current.ms,
+            level,
+            parent=spans[-1].name if spans else None,
+            thread=threading.current_thread().name,
+            **current.attributes,
+        )
+
+
+def traced(func):
+    """Run every call of `func` in a span named after it."""
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def annotate(**attributes):
+    """Set attributes on the innermost open span of this thread, if any."""
+    spans = stack()
+    if spans:
+        spans[-1].set(**attributes)
+
+
+def start_rerun() -> Rerun:
+    """Collect the spans this thread opens from now on."""
+    local.rerun = Rerun()
+    return local.rerun
+
+
+def end_rerun(rerun: Rerun, name: str = "rerun", **attributes) -> Rerun:
+    """Stop collecting spans and record the whole rerun as the stage `name`."""
+    local.rerun = None
+    rerun.ms = (time.perf_counter() - rerun.start) * 1e3
+
+    record(name, rerun.ms)
+    emit("rerun", name, rerun.ms, logging.INFO, spans=len(rerun.spans), **attributes)
+
+    return rerun
+
+
+def rerun_table(rerun: Rerun) -> pd.DataFrame:
+    """Spans of a rerun in the order they opened, nested ones indented."""
+    return pd.DataFrame(
+        [
+            {
+                "stage": "\u2003" * depth + current.name,
+                "ms": current.ms,
+                "cache": {True: "hit", False: "miss"}.get(
+                    current.attributes.get("hit")
+                ),
+                "p95_ms": stage_summary(current.name)["p95_ms"],
+            }
+            for depth, current in rerun.spans
+            if current.ms is not None
+        ],
+        columns=["stage", "ms", "cache", "p95_ms"],
+    )
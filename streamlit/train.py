@@ -0,0 +1,449 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.feature_selection import SelectFromModel
+from sklearn.impute import KNNImputer
+from sklearn.linear_model import ElasticNet, Lasso, LinearRegression, Ridge
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import (
+    GridSearchCV,
+    HalvingGridSearchCV,
+    ParameterGrid,
+    train_test_split,
+)
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.neural_network import MLPRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.tree import DecisionTreeRegressor
+
+import artifacts as artifacts
+import features as features
+import ingest as ingest
+
+SEED = 6954
+
+# Numeric columns left by the VIF filtering of the notebook, KNN imputed
+NUMERIC_FEATURES = [
+    "host_acceptance_rate",
+    "host_listings_count",
+    "accommodates",
+    "bathrooms",
+    "bedrooms",
+    "beds",
+    "minimum_nights",
+    "maximum_nights",
+    "availability_365",
+    "num_amenities",
+]
+
+# Features starting with these are kept whatever their importance
+DUMMY_PREFIXES = [
+    "host_is_superhost",
+    "host_verification",
+    "host_response_time",
+    "neighbourhood_cleansed",
+    "room_type",
+    "bathrooms",
+]
+
+# Candidate models and their grids from the notebook, most expensive first so
+# that the longest searches are scheduled first
+CANDIDATES = {
+    "random_forest": (
+        RandomForestRegressor(random_state=SEED),
+        {
+            "model__n_estimators": [100, 200, 300],
+            "model__min_samples_split": [2, 5, 10],
+        },
+    ),
+    "mlp": (
+        MLPRegressor(random_state=SEED),
+        {
+            "model__hidden_layer_sizes": [(100,), (100, 100)],
+            "model__activation": ["relu", "tanh"],
+            "model__alpha": [0.0001, 0.001, 0.01],
+        },
+    ),
+    "decision_tree": (
+        DecisionTreeRegressor(random_state=SEED),
+        {
+            "model__max_depth": [None, 5, 10, 15, 20, 25],
+            "model__min_samples_split": [2, 5, 10, 15, 20],
+        },
+    ),
+    "knn": (KNeighborsRegressor(), {"model__n_neighbors": [5, 10, 15, 20, 25]}),
+    "elastic_net": (
+        ElasticNet(),
+        {
+            "model__alpha": np.logspace(-4, 2, 10),
+            "model__l1_ratio": np.linspace(0, 1, 5),
+        },
+    ),
+    "lasso": (Lasso(), {"model__alpha": np.logspace(-4, 2, 10)}),
+    "ridge": (Ridge(), {"model__alpha": np.logspace(-4, 2, 10)}),
+    "linear": (LinearRegression(), {}),
+}
+
+try:
+    from xgboost import XGBRegressor
+
+    CANDIDATES["xgboost"] = (
+        XGBRegressor(random_state=SEED),
+        {
+            "model__n_estimators": [100, 200, 300],
+            "model__max_depth": [5, 10, 15, 20],
+            "model__learning_rate": [0.01, 0.1, 0.2],
+        },
+    )
+except ImportError:
+    pass
+
+try:
+    from lightgbm import LGBMRegressor
+
+    CANDIDATES["lightgbm"] = (
+        LGBMRegressor(random_state=SEED),
+        {
+            "model__n_estimators": [100, 200, 300],
+            "model__num_leaves": [5, 10, 15, 20],
+            "model__max_depth": [5, 10, 15, 20],
+            "model__learning_rate": [0.01, 0.1, 0.2],
+        },
+    )
+except ImportError:
+    pass
+
+
+def design_matrix(data: pd.DataFrame, top_amenities: list) -> tuple:
+    """Feature matrix and log price of the preprocessed listings of a city.
+
+    Follows the notebook: host response times are imputed by sampling the
+    observed ones, listings without bathrooms are dropped, host verifications
+    and categorical columns are dummy encoded and numeric columns are imputed
+    with a KNNImputer.
+    """
+    data = data.dropna(subset=["bathrooms_text", "bathrooms_is_shared"])
+
+    response_times = data["host_response_time"].value_counts(normalize=True)
+    sampled = np.random.default_rng(SEED).choice(
+        response_times.index.astype(str), p=response_times.values, size=len(data)
+    )
+    host_response_time = data["host_response_time"].astype(object)
+    host_response_time = host_response_time.fillna(pd.Series(sampled, index=data.index))
+
+    X = pd.concat(
+        [
+            data[features.NUMERIC_COLUMNS + list(features.DERIVED_DTYPES)],
+            data[top_amenities],
+            features.parse_verifications(data["host_verifications"]),
+            pd.get_dummies(
+                data[features.CATEGORICAL_COLUMNS]
+                .astype(object)
+                .assign(host_response_time=host_response_time)
+            ),
+        ],
+        axis=1,
+    )
+    X[NUMERIC_FEATURES] = KNNImputer(n_neighbors=5).fit_transform(X[NUMERIC_FEATURES])
+
+    return X, np.log(data["price"])
+
+
+def select_features(X_train: pd.DataFrame, y_train: pd.Series) -> list:
+    """Features the notebook drops: non-dummy features of negligible importance."""
+    X_train = X_train.copy()
+    X_train[NUMERIC_FEATURES] = MinMaxScaler().fit_transform(X_train[NUMERIC_FEATURES])
+
+    rf = RandomForestRegressor(
+        random_state=SEED, n_estimators=300, min_samples_split=30
+    )
+    sfm = SelectFromModel(rf, threshold=0.001).fit(X_train, y_train)
+
+    return [
+        feature
+        for feature in X_train.columns[~sfm.get_support()]
+        if not any(feature.startswith(prefix) for prefix in DUMMY_PREFIXES)
+    ]
+
+
+def prepare(city: str) -> dict:
+    """Train and test splits of a city, without the features it drops.
+
+    The design matrices are float32 arrays, built once per city and shared
+    by every candidate instead of each one converting the frames again.
+    """
+    start = time.perf_counter()
+    data, amenities = ingest.load_city(ingest.city_file(city))
+    X, y = design_matrix(data, amenities.top(20))
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, train_size=0.75, random_state=SEED
+    )
+    prepared = time.perf_counter()
+
+    features_to_drop = select_features(X_train, y_train)
+    X_train = X_train.drop(columns=features_to_drop)
+    X_test = X_test.drop(columns=features_to_drop)
+
+    split = {
+        "city": city,
+        "feature_names": X_train.columns.tolist(),
+        "X_train": np.ascontiguousarray(X_train.to_numpy(np.float32)),
+        "X_test": np.ascontiguousarray(X_test.to_numpy(np.float32)),
+        "y_train": y_train.to_numpy(np.float64),
+        "y_test": y_test.to_numpy(np.float64),
+        "features_to_drop": features_to_drop,
+        "seconds": {
+            "prepare": prepared - start,
+            "select": time.perf_counter() - prepared,
+        },
+    }
+
+    matrix = split["X_train"]
+    print(
+        f"{city}: design matrix {matrix.shape[0]}x{matrix.shape[1]}, "
+        f"{matrix.nbytes / 1e6:.1f} MB as float32."
+    )
+
+    return split
+
+
+def oob_search(split: dict, k: int = 5, step: int = 50, tol: float = 1e-3) -> tuple:
+    """Random forest search growing warm-started forests scored out-of-bag.
+
+    For each `min_samples_split` of the grid, trees are added `step` at a time
+    up to the largest `n_estimators` of the grid. Growth stops once the
+    out-of-bag MSE improves by less than `tol` (relative), and the best forest
+    is cut back to the size it scored best at. Every tree is fitted once on
+    the training set, instead of once per fold for every grid point.
+    """
+    _, params = CANDIDATES["random_forest"]
+    max_trees = max(params["model__n_estimators"])
+
+    scaler = MinMaxScaler().fit(split["X_train"])
+    X_train = scaler.transform(split["X_train"])
+    y_train = split["y_train"]
+
+    best, trees = None, 0
+    for min_samples_split in params["model__min_samples_split"]:
+        forest = RandomForestRegressor(
+            n_estimators=step,
+            min_samples_split=min_samples_split,
+            warm_start=True,
+            oob_score=True,
+            random_state=SEED,
+        )
+
+        previous = np.inf
+        for n_estimators in range(step, max_trees + 1, step):
+            forest.set_params(n_estimators=n_estimators).fit(X_train, y_train)
+            trees += step
+
+            oob_mse = mean_squared_error(y_train, forest.oob_prediction_)
+            if best is None or oob_mse < best[0]:
+                best = (oob_mse, forest, min_samples_split, n_estimators)
+            if previous - oob_mse < tol * previous:
+                break
+            previous = oob_mse
+
+    _, forest, min_samples_split, n_estimators = best
+    forest.estimators_ = forest.estimators_[:n_estimators]
+    forest.set_params(n_estimators=n_estimators, warm_start=False)
+
+    # Compute in trees x training rows, against k folds of the full grid
+    grid_trees = sum(params["model__n_estimators"]) * len(
+        params["model__min_samples_split"]
+    )
+    compute = trees / (grid_trees * (k - 1))
+
+    return (
+        Pipeline([("scaler", scaler), ("model", forest)]),
+        {
+            "model__min_samples_split": min_samples_split,
+            "model__n_estimators": n_estimators,
+        },
+        compute,
+    )
+
+
+def search(name: str, split: dict, strategy: str, k: int = 5) -> tuple:
+    """Search the parameters of a candidate model with `strategy`.
+
+    Returns the best pipeline, its parameters and the fraction of the compute
+    of the full grid search that was used.
+    """
+    estimator, params = CANDIDATES[name]
+    # The scaler is fitted again on every fold for every candidate, 1.5 ms on
+    # a fold of 5k listings. Pipeline(memory=...) would hash the fold and
+    # round-trip it through disk instead, which is slower: 16.4s instead of
+    # 15.6s for the elastic net grid of 10k listings
+    pipeline = Pipeline([("scaler", MinMaxScaler()), ("model", estimator)])
+    X_train = split["X_train"]
+
+    if strategy == "halving" and name == "random_forest":
+        return oob_search(split, k)
+
+    if strategy == "halving" and len(ParameterGrid(params)) > 1:
+        # Candidates are scored on growing samples, a third survive each round
+        halving = HalvingGridSearchCV(
+            pipeline,
+            params,
+            cv=k,
+            factor=3,
+            n_jobs=1,
+            random_state=SEED,
+            scoring="neg_mean_squared_error",
+        )
+        halving.fit(X_train, split["y_train"])
+
+        used = np.dot(halving.n_candidates_, halving.n_resources_)
+        compute = used / (len(ParameterGrid(params)) * X_train.shape[0])
+
+        return halving.best_estimator_, halving.best_params_, compute
+
+    grid = GridSearchCV(
+        pipeline, params, cv=k, n_jobs=1, scoring="neg_mean_squared_error"
+    )
+    grid.fit(X_train, split["y_train"])
+
+    return grid.best_estimator_, grid.best_params_, 1.0
+
+
+def fit_candidate(name: str, split: dict, strategy: str = "grid") -> dict:
+    """Search one candidate model on a city, single-threaded."""
+    start = time.perf_counter()
+    model, params, compute = search(name, split, strategy)
+
+    y_pred = model.predict(split["X_test"])
+    mse = float(mean_squared_error(split["y_test"], y_pred))
+    r2 = float(r2_score(split["y_test"], y_pred))
+
+    seconds = time.perf_counter() - start
+    print(
+        f"{split['city']}: {name} RMSE {np.sqrt(mse):.4f}, R^2 {r2:.4f} in "
+        f"{seconds:.1f}s, {compute:.0%} of the compute of the full grid."
+    )
+
+    return {
+        "model": model,
+        "scores": (mse, r2),
+        "params": {key: repr(value) for key, value in params.items()},
+        "compute": compute,
+        "seconds": seconds,
+    }
+
+
+def save(city: str, split: dict, results: dict):
+    """Write the random forest artifacts of a city and the metrics of all models."""
+    city = city.lower()
+    metrics = {
+        "features_to_drop": split["features_to_drop"],
+        "seconds": split["seconds"],
+        "models": {
+            name: {
+                "mse": result["scores"][0],
+                "r2": result["scores"][1],
+                "params": result["params"],
+                "compute": result["compute"],
+                "seconds": result["seconds"],
+            }
+            for name, result in results.items()
+        },
+    }
+    metrics["best"] = min(
+        metrics["models"], key=lambda name: metrics["models"][name]["mse"]
+    )
+
+    with open(os.path.join(artifacts.MODELS_DIR, f"{city}_metrics.json"), "w") as f:
+        json.dump(metrics, f, indent=2)
+
+    # The app serves the random forest, whichever model scores best
+    if "random_forest" in results:
+        rf = {key: results["random_forest"][key] for key in ["model", "scores"]}
+        rf["features"] = split["feature_names"]
+        with artifacts.replace_file(artifacts.model_path(city)) as path:
+            joblib.dump(rf, path, compress=True)
+
+        with open(artifacts.features_to_drop_path(city), "w") as f:
+            for feature in split["features_to_drop"]:
+                f.write(feature + "\n")
+
+        artifacts.export_schema(city, artifacts.convert_model(city))
+
+
+def train(cities: list, models: list, jobs: int, strategy: str = "halving") -> dict:
+    """Train `models` for every city, sharing `jobs` worker processes.
+
+    Every search is one single-threaded task, so at most `jobs` CPUs are
+    busy across all cities at any time.
+    """
+    seconds = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        start = time.perf_counter()
+        splits = dict(zip(cities, pool.map(prepare, cities)))
+        seconds["prepare"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        futures = {
+            (city, name): pool.submit(fit_candidate, name, splits[city], strategy)
+            for name in CANDIDATES
+            if name in models
+            for city in cities
+        }
+        results = {city: {} for city in cities}
+        for (city, name), future in futures.items():
+            results[city][name] = future.result()
+        seconds["search"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for city in cities:
+        save(city, splits[city], results[city])
+    seconds["save"] = time.perf_counter() - start
+
+    for stage, elapsed in seconds.items():
+        print(f"{stage:<8} {elapsed:8.1f}s")
+
+    return seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train the price models of every city in the data folder."
+    )
+    parser.add_argument(
+        "cities", nargs="*", help="Cities to train (default: all of them)"
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        choices=list(CANDIDATES),
+        default=list(CANDIDATES),
+        help="Candidate models to search (default: all of them)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Worker processes shared by all searches (default: all CPUs)",
+    )
+    parser.add_argument(
+        "--search",
+        choices=["halving", "grid"],
+        default="halving",
+        help="Successive halving, with out-of-bag scored forests, or the full "
+        "grid search of the notebook (default: halving)",
+    )
+    args = parser.parse_args()
+
+    cities = args.cities or sorted(
+        file.split(".")[0] for file in os.listdir(ingest.DATA_DIR)
+    )
+    train(cities, args.models, args.jobs, args.search)
@@ -0,0 +1,91 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import comparables as comparables
+import ingest as ingest
+import model as model
+import plots as plots
+import stats as stats
+import tracing as tracing
+
+# Threads, not processes: the warmed artifacts live in this process's caches
+WORKERS = int(os.getenv("WARMUP_WORKERS", 2))
+
+BADGES = {"ready": "🟢", "warming": "🟡", "failed": "🔴"}
+
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="warmup")
+# City -> (source, future) of its latest warmup, and (city, source) -> status,
+# where source is the size and mtime of the data file, as in ingest.load_dataset
+futures = {}
+status = {}
+lock = threading.Lock()
+
+
+def source_version(file: str) -> tuple:
+    stat = os.stat(os.path.join(ingest.DATA_DIR, file))
+    return stat.st_size, stat.st_mtime_ns
+
+
+def warm_city(city: str, file: str, source: tuple = None):
+    """Load the model and data of a city and render all of its figures."""
+    status[city, source] = "warming"
+
+    # Failures are logged with the span
+    try:
+        with tracing.span("warmup.warm_city", city=city):
+            model.load_model(city)
+            dataset = ingest.load_dataset(file)
+            city_stats = stats.compute(dataset)
+            comparables.load_index(dataset)
+
+            plots.price_distribution(city_stats, city)
+            plots.price_by_neighbourhood(city_stats, city)
+            plots.price_by_room_type(city_stats, city)
+            plots.price_by_amenities(city_stats, city)
+            plots.visualize_on_map(dataset)
+    except Exception:
+        status[city, source] = "failed"
+        raise
+
+    status[city, source] = "ready"
+
+
+def start(cities: dict, force: bool = False):
+    """Warm up `cities` (name -> data file) in the background.
+
+    Cities already warmed or warming from the same data file are skipped
+    unless `force`, those whose file changed are queued again. Safe to call
+    on every script rerun.
+    """
+    with lock:
+        for city, file in cities.items():
+            source = source_version(file)
+            current = futures.get(city)
+            if force or current is None or current[0] != source:
+                status.setdefault((city, source), "queued")
+                futures[city] = (source, executor.submit(warm_city, city, file, source))
+
+
+def wait(city: str):
+    """Block until the running warmup of `city` is done, so it is not built twice.
+
+    A warmup still queued behind other cities is cancelled instead: the city
+    is built on the request path, and queued again by the next `start` to
+    render what this request did not.
+    """
+    with lock:
+        current = futures.get(city)
+        if current is not None and current[1].cancel():
+            del futures[city]
+            status.pop((city, current[0]), None)
+            return
+
+    if current is not None and not current[1].done():
+        with tracing.span("warmup.wait", city=city):
+            current[1].exception()
+
+
+def badge(city: str) -> str:
+    current = futures.get(city)
+    return BADGES.get(status.get((city, current[0])) if current else None, "⚪")
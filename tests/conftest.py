@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "streamlit"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import synthetic as synthetic  # noqa: E402
+
+CITY = "Munich"
+
+
+@pytest.fixture(scope="session")
+def city_root(tmp_path_factory) -> str:
+    """Synthetic listings and model of `CITY`, laid out as the repository root."""
+    root = str(tmp_path_factory.mktemp("city"))
+    synthetic.generate(root, 1000, CITY.lower())
+    return root
+
+
+@pytest.fixture
+def in_city_root(city_root, monkeypatch) -> str:
+    # Data, cache and model paths are relative to the repository root
+    monkeypatch.chdir(city_root)
+    return city_root
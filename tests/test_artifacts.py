@@ -0,0 +1,74 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import artifacts as artifacts
+import model as model
+from conftest import CITY
+
+
+def test_served_model_does_not_load_the_estimator(in_city_root):
+    served = artifacts.load_model(CITY)
+
+    assert "model" not in served
+    assert isinstance(served["forest"].threshold, np.memmap)
+
+    X = np.random.default_rng(0).random((50, served["n_features"]))
+    prices = served["forest"].predict(X)
+
+    # The estimator is loaded on first access, for batch scoring and refreshes
+    np.testing.assert_allclose(prices, served["model"].predict(X), atol=1e-9)
+
+
+def test_model_is_converted_again_once_it_changes(in_city_root):
+    artifacts.load_model(CITY)
+    path = artifacts.model_path(CITY)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    served, spec = model.load_model(CITY)
+
+    assert served["version"] == artifacts.model_version(CITY)
+    assert "model" not in served
+    assert served["n_features"] == len(spec.feature_names)
+    with open(artifacts.model_info_path(CITY)) as f:
+        assert json.load(f)["version"] == served["version"]
+
+
+def test_each_model_version_gets_its_own_forest(in_city_root):
+    served = artifacts.load_model(CITY)
+    path = artifacts.model_path(CITY)
+    first = artifacts.forest_path(CITY, artifacts.model_version(CITY))
+
+    for step in range(1, 4):
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + step * 10**9))
+        reloaded = artifacts.load_model(CITY)
+
+    # The forest mapped before is left alone, older ones are removed
+    current = artifacts.forest_path(CITY, artifacts.model_version(CITY))
+    kept = sorted(os.listdir(artifacts.forests_dir(CITY)))
+    assert len(kept) == artifacts.FORESTS_KEPT and os.path.basename(current) in kept
+    assert not os.path.exists(first)
+    np.testing.assert_array_equal(
+        np.asarray(reloaded["forest"].value), np.asarray(served["forest"].value)
+    )
+
+
+def test_replace_file_keeps_the_old_file_on_failure(tmp_path):
+    path = tmp_path / "artifact.json"
+    path.write_text("old")
+
+    with pytest.raises(RuntimeError):
+        with artifacts.replace_file(str(path)) as temporary:
+            with open(temporary, "w") as f:
+                f.write("half")
+            raise RuntimeError
+
+    with artifacts.replace_file(str(path)) as temporary:
+        with open(temporary, "w") as f:
+            f.write("new")
+
+    assert os.listdir(tmp_path) == ["artifact.json"] and path.read_text() == "new"
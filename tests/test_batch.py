@@ -0,0 +1,23 @@
+import os
+
+import joblib
+import numpy as np
+
+import artifacts as artifacts
+import batch as batch
+import features as features
+import ingest as ingest
+from conftest import CITY
+
+
+def test_predict_batch_scales_like_the_pipeline(in_city_root):
+    rf = joblib.load(artifacts.model_path(CITY))
+    spec = artifacts.load_schema(CITY)
+    listings = batch.read_listings(
+        os.path.join(ingest.DATA_DIR, ingest.city_file(CITY))
+    )
+
+    prices = batch.predict_batch(rf, spec, listings)
+
+    expected = rf["model"].predict(features.encode_listings(listings, spec))
+    np.testing.assert_allclose(np.log(prices), expected)
@@ -0,0 +1,40 @@
+import json
+import logging
+
+import cache as cache
+import tracing as tracing
+
+
+class Events(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append((record.levelno, json.loads(record.getMessage())))
+
+
+def test_evictions_and_skips_are_logged_as_events(monkeypatch):
+    events = Events()
+    monkeypatch.setattr(tracing.logger, "handlers", [events])
+    level = tracing.logger.level
+    tracing.logger.setLevel(logging.DEBUG)
+    try:
+        lru = cache.LRUCache("figures", 100)
+        lru.put("first", 1, 60)
+        lru.put("second", 2, 60)
+        lru.put("huge", 3, 1000)
+    finally:
+        tracing.logger.setLevel(level)
+
+    assert lru.stats()["entries"] == 1 and lru.get("second") == (True, 2)
+    assert events.lines == [
+        (
+            logging.INFO,
+            {"event": "cache.evict", "cache": "figures", "key": "first", "bytes": 60},
+        ),
+        (
+            logging.WARNING,
+            {"event": "cache.skip", "cache": "figures", "key": "huge", "bytes": 1000},
+        ),
+    ]
@@ -0,0 +1,19 @@
+import dataclasses
+
+import pytest
+
+import comparables as comparables
+import ingest as ingest
+from conftest import CITY
+
+
+@pytest.mark.usefixtures("in_city_root")
+def test_query_returns_every_listing_of_small_cities():
+    dataset = ingest.load_dataset(ingest.city_file(CITY))
+    small = dataclasses.replace(dataset, data=dataset.data.head(5))
+
+    index = comparables.build_index(small)
+    positions, km = index.query(small.data.head(1), k=20)
+
+    assert positions.shape == km.shape == (1, 5)
+    assert sorted(positions[0]) == list(range(5)) and km[0, 0] == 0
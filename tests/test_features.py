@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+
+import artifacts as artifacts
+import batch as batch
+import features as features
+import ingest as ingest
+from conftest import CITY
+
+LISTING = {
+    "room_type": "Private room",
+    "accommodates": 2,
+    "instant_bookable": True,
+    "amenities": ["Wifi", "Not an amenity"],
+    "host_verifications": ["email"],
+}
+
+
+def test_encode_attributes_accepts_a_valid_listing(in_city_root):
+    spec = artifacts.load_schema(CITY)
+
+    row = spec.encode_attributes(LISTING)
+
+    assert row[0, spec.index["room_type_Private room"]] == 1
+    assert row[0, spec.index["accommodates"]] == 2
+
+
+@pytest.mark.parametrize(
+    "attributes, problem",
+    [
+        ({"acommodates": 2}, "unknown attribute 'acommodates'"),
+        ({"room_type": "Castle"}, "room_type: unseen value 'Castle'"),
+        ({"accommodates": None}, "accommodates: not a number: None"),
+        ({"accommodates": "2"}, "accommodates: not a number: '2'"),
+        ({"host_verifications": ["carrier pigeon"]}, "unseen value 'carrier pigeon'"),
+        ({"amenities": "Wifi"}, "amenities: not a list of strings"),
+    ],
+)
+def test_encode_attributes_rejects_invalid_listings(in_city_root, attributes, problem):
+    spec = artifacts.load_schema(CITY)
+
+    with pytest.raises(ValueError, match=problem):
+        spec.encode_attributes({**LISTING, **attributes})
+
+
+def test_every_problem_is_reported(in_city_root):
+    spec = artifacts.load_schema(CITY)
+
+    problems = spec.check_attributes({"acommodates": 2, "room_type": "Castle"})
+
+    assert len(problems) == 2
+
+
+def test_encode_listings_accepts_a_column_missing_from_the_batch(in_city_root):
+    spec = artifacts.load_schema(CITY)
+    data = batch.read_listings(os.path.join(ingest.DATA_DIR, ingest.city_file(CITY)))
+    data = data.head(20)
+
+    X = features.encode_listings(data, spec)
+    missing = features.encode_listings(data.assign(host_response_time=np.nan), spec)
+
+    dummies = spec.positions(spec.options["host_response_time"])
+    dummies = dummies[dummies >= 0]
+    assert not missing[:, dummies].any()
+    np.testing.assert_array_equal(
+        np.delete(missing, dummies, axis=1), np.delete(X, dummies, axis=1)
+    )
@@ -0,0 +1,35 @@
+import os
+
+import joblib
+import numpy as np
+
+import artifacts as artifacts
+import batch as batch
+import features as features
+import forest as forest
+import ingest as ingest
+from conftest import CITY
+
+
+def test_flat_forest_agrees_with_pipeline(in_city_root):
+    rf = joblib.load(artifacts.model_path(CITY))
+    spec = artifacts.load_schema(CITY)
+    listings = batch.read_listings(
+        os.path.join(ingest.DATA_DIR, ingest.city_file(CITY))
+    )
+    X = features.encode_listings(listings, spec)
+
+    flat = forest.FlatForest.from_model(rf)
+
+    # The scaler of the pipeline is folded into the flat thresholds
+    np.testing.assert_allclose(flat.predict(X), rf["model"].predict(X), atol=1e-9)
+
+
+def test_saved_flat_forest_agrees_with_pipeline(in_city_root, tmp_path):
+    rf = joblib.load(artifacts.model_path(CITY))
+    X = np.random.default_rng(0).random((200, rf["model"][-1].n_features_in_))
+
+    forest.FlatForest.from_model(rf).save(str(tmp_path))
+    flat = forest.FlatForest.load(str(tmp_path))
+
+    np.testing.assert_allclose(flat.predict(X), rf["model"].predict(X), atol=1e-9)
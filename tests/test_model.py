@@ -0,0 +1,46 @@
+import copy
+
+import pytest
+
+import bench_pipeline as bench_pipeline
+import model as model
+from conftest import CITY
+
+
+@pytest.mark.usefixtures("in_city_root")
+def test_what_if_skips_amenities_the_model_does_not_use():
+    rf, spec = model.load_model(CITY)
+    dropped = sorted(spec.top_amenities)[0]
+
+    # A top amenity among the features the model was trained without
+    spec = copy.copy(spec)
+    spec.index = {name: i for name, i in spec.index.items() if name != dropped}
+    row = spec.encode_attributes(bench_pipeline.LISTING)
+
+    table = model.what_if(rf, spec, row, CITY)
+    amenities = table[table["attribute"] == "Amenities"]["change"]
+    assert not amenities.str.endswith(f" {dropped}").any()
+    assert len(amenities) == len(spec.top_amenities) - 1
+
+
+@pytest.mark.usefixtures("in_city_root")
+def test_what_if_leaves_other_features_alone_without_an_amenity_count(monkeypatch):
+    rf, spec = model.load_model(CITY)
+
+    # A model trained without the number of amenities
+    spec = copy.copy(spec)
+    spec.index = {name: i for name, i in spec.index.items() if name != "num_amenities"}
+    row = spec.encode_attributes(bench_pipeline.LISTING)
+
+    scored = []
+    predict_rows = model.predict_rows
+    monkeypatch.setattr(
+        model,
+        "predict_rows",
+        lambda rf, X, city: scored.append(X) or predict_rows(rf, X, city),
+    )
+    table = model.what_if(rf, spec, row, CITY)
+
+    # Every variant changes one feature, amenities toggled included
+    assert (table["attribute"] == "Amenities").any()
+    assert ((scored[0][1:] != row).sum(axis=1) == 1).all()
@@ -0,0 +1,82 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import artifacts as artifacts
+import ingest as ingest
+import refresh as refresh
+from conftest import CITY
+
+
+@pytest.fixture
+def source(city_root, tmp_path, monkeypatch) -> str:
+    """Data file of a copy of the synthetic city, with its cache snapshot built."""
+    root = tmp_path / "root"
+    shutil.copytree(city_root, root)
+    monkeypatch.chdir(root)
+
+    file = ingest.city_file(CITY)
+    ingest.build(file)
+    return os.path.join(ingest.DATA_DIR, file)
+
+
+def rescrape(path: str, price_factor: float = 1.0):
+    """Scrape with 100 listings changed, 50 removed and 50 new ones.
+
+    The prices of 300 kept listings are multiplied by `price_factor`.
+    """
+    data = pd.read_csv(path)
+    data.loc[:99, "amenities"] = data.loc[:99, "amenities"].str.replace(
+        "]", ', "Sauna"]', regex=False
+    )
+    prices = data.loc[200:499, "price"].str.strip("$").str.replace(",", "")
+    data.loc[200:499, "price"] = [
+        f"${price:,.2f}" for price in prices.astype(float) * price_factor
+    ]
+
+    added = data.iloc[150:200].assign(id=lambda new: new["id"] + 10**6)
+    data = pd.concat([data.drop(index=range(100, 150)), added])
+    data.to_csv(path, index=False)
+
+
+def test_refresh_matches_a_full_build(source):
+    rescrape(source)
+    file = os.path.basename(source)
+
+    report = refresh.refresh(CITY)["refresh"]
+    spliced, spliced_tokens = ingest.read_cache(file)
+
+    ingest.build(file)
+    built, built_tokens = ingest.read_cache(file)
+
+    assert (report["added"], report["changed"], report["removed"]) == (50, 100, 50)
+    assert report["trees_replaced"] == 0
+    pd.testing.assert_frame_equal(spliced, built)
+    np.testing.assert_array_equal(spliced_tokens.vocabulary, built_tokens.vocabulary)
+    np.testing.assert_array_equal(spliced_tokens.counts, built_tokens.counts)
+    assert (spliced_tokens.matrix != built_tokens.matrix).nnz == 0
+
+
+def test_drifted_prices_refresh_the_model(source):
+    n_trees = len(artifacts.load_estimator(CITY)["model"][-1].estimators_)
+    version = artifacts.model_version(CITY)
+    rescrape(source, price_factor=3.0)
+
+    report = refresh.refresh(CITY)["refresh"]
+
+    assert "price" in report["drifted"]
+    assert report["trees_replaced"] >= refresh.MIN_NEW_TREES
+    assert artifacts.model_version(CITY) != version
+
+    # The served forest is converted from the refreshed pipeline
+    served = artifacts.load_model(CITY)
+    pipeline = served["model"]
+    assert len(pipeline[-1].estimators_) == n_trees
+
+    X = np.random.default_rng(0).random((50, served["n_features"]))
+    np.testing.assert_allclose(
+        served["forest"].predict(X), pipeline.predict(X), atol=1e-9
+    )
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+import tornado.testing
+
+import serve as serve
+from conftest import CITY
+
+
+@pytest.mark.usefixtures("in_city_root")
+class TestServe(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return serve.make_app([CITY])
+
+    def post(self, path: str, body) -> tuple:
+        response = self.fetch(path, method="POST", body=json.dumps(body))
+        return response.code, json.loads(response.body)
+
+    def test_predict(self):
+        code, body = self.post(f"/predict/{CITY}", {"accommodates": 2})
+
+        assert code == 200
+        assert body["price"] > 0
+
+    def test_invalid_listing_lists_its_problems(self):
+        code, body = self.post(
+            f"/predict/{CITY}", {"acommodates": 2, "room_type": "Castle"}
+        )
+
+        assert code == 400
+        assert "'acommodates'" in body["error"]
+        assert "'Castle'" in body["error"]
+
+    def test_null_attribute_is_rejected(self):
+        code, body = self.post(f"/what-if/{CITY}", {"accommodates": None})
+
+        assert code == 400
+        assert "accommodates" in body["error"]
+
+    def test_unknown_city(self):
+        code, body = self.post("/predict/atlantis", {"accommodates": 2})
+
+        assert code == 404
+        assert body["error"] == "No model for atlantis"
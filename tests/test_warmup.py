@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ingest as ingest
+import warmup as warmup
+
+CITIES = {"Boston": "boston.csv", "Munich": "munich.csv"}
+
+
+@pytest.fixture
+def warming(tmp_path, monkeypatch):
+    """Warmups of stub cities on one worker, held until the event is set."""
+    (tmp_path / ingest.DATA_DIR).mkdir()
+    for file in CITIES.values():
+        (tmp_path / ingest.DATA_DIR / file).write_text("id\n1\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(warmup, "futures", {})
+    monkeypatch.setattr(warmup, "status", {})
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(warmup, "executor", executor)
+
+    release = threading.Event()
+    calls = []
+
+    def warm_city(city, file, source=None):
+        calls.append((city, source))
+        warmup.status[city, source] = "warming"
+        release.wait(10)
+        warmup.status[city, source] = "ready"
+
+    monkeypatch.setattr(warmup, "warm_city", warm_city)
+    yield release, calls
+    release.set()
+    executor.shutdown()
+
+
+def test_changed_source_is_queued_again(warming):
+    release, calls = warming
+    cities = {"Munich": "munich.csv"}
+
+    warmup.start(cities)
+    warmup.start(cities)
+    release.set()
+    warmup.futures["Munich"][1].result()
+    assert len(calls) == 1
+    assert warmup.badge("Munich") == warmup.BADGES["ready"]
+
+    path = os.path.join(ingest.DATA_DIR, "munich.csv")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    release.clear()
+    warmup.start(cities)
+    assert warmup.badge("Munich") != warmup.BADGES["ready"]
+
+    release.set()
+    warmup.futures["Munich"][1].result()
+    assert len(calls) == 2 and calls[0] != calls[1]
+    assert warmup.badge("Munich") == warmup.BADGES["ready"]
+
+
+def test_wait_blocks_on_running_warmup(warming):
+    release, _ = warming
+    warmup.start({"Munich": "munich.csv"})
+    while warmup.badge("Munich") != warmup.BADGES["warming"]:
+        time.sleep(0.01)
+
+    threading.Timer(0.2, release.set).start()
+    warmup.wait("Munich")
+    assert warmup.badge("Munich") == warmup.BADGES["ready"]
+
+
+def test_wait_cancels_warmup_queued_behind_other_cities(warming):
+    release, calls = warming
+    warmup.start(CITIES)
+    while warmup.badge("Boston") != warmup.BADGES["warming"]:
+        time.sleep(0.01)
+
+    # Boston holds the only worker, Munich is built on the request path
+    warmup.wait("Munich")
+    assert not release.is_set()
+    assert [city for city, _ in calls] == ["Boston"]
+    assert warmup.badge("Munich") == "⚪"
+
+    warmup.start(CITIES)
+    release.set()
+    warmup.futures["Munich"][1].result()
+    assert [city for city, _ in calls] == ["Boston", "Munich"]
+    assert warmup.badge("Munich") == warmup.BADGES["ready"]